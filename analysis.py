@@ -1,22 +1,373 @@
 import pandas as pd
+import numpy as np
 from datetime import datetime
+from contextlib import contextmanager
 import time
 import threading
+import queue
 import json
 import os
-from typing import Dict, List, Optional
+import sqlite3
+import glob
+import argparse
+from typing import Dict, Iterator, List, Optional
+
+from logutil import get_logger
+
+log = get_logger("analysis")
+
+# Columns stored directly in the metrics table, anything else in a metric goes in 'extra' (JSON)
+METRIC_COLUMNS = ['timestamp', 'source', 'action', 'filename', 'file_size_bytes', 'duration_seconds',
+                  'transfer_rate_mbps', 'client_id', 'status', 'system_uptime']
+
+class MetricsStore:
+    def __init__(self, db_path: str, batch_size: int=200, flush_interval: float=5.0, max_pending: int=10_000):
+        '''
+        Purpose: Persistent metrics history shared by every run (SQLite), indexed on timestamp,
+        action and client_id so queries over any time range/client don't load everything.
+        Callers only queue rows, one writer thread batches them into SQLite, so a locked
+        database never holds up a request handler.
+
+        Parameters:
+            db_path: SQLite database file (created if missing)
+            batch_size: Metrics buffered before they're written in one transaction
+            flush_interval: Max seconds a buffered metric waits before being written
+            max_pending: Metrics queued for the writer (and kept for retrying while the database
+                can't be written), past that new ones are dropped and counted
+        '''
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.queue = queue.Queue(maxsize=max_pending) # rows, or a [done_event, stop] request
+        self.pending: List[tuple] = [] # writer thread only
+        self.last_flush = time.time()
+        self.retry_at = 0.0 # after a failed write, don't try again before this
+        self.failing = False
+        self.dropped = 0
+        self.lock = threading.Lock() # starting the writer and the dropped count
+        self.thread = None
+        self.pid = os.getpid()
+        self.conn = None # writer thread only, opened on first use so a store made before fork() isn't shared
+    
+    def _connect_unsafe(self):
+        """
+        Purpose: Open the database and create the schema if needed. Writer thread only.
+        """
+        if self.conn is not None:
+            return
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        try:
+            self._create_schema(conn)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        self.conn = conn
+    
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection):
+        """
+        Purpose: Create the metrics table and its indexes if missing
+        """
+        conn.execute("PRAGMA journal_mode=WAL") # readers don't block the writers (e.g. prefork workers)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS metrics (
+                id INTEGER PRIMARY KEY,
+                timestamp TEXT NOT NULL,
+                source TEXT,
+                action TEXT NOT NULL,
+                filename TEXT,
+                file_size_bytes INTEGER,
+                duration_seconds REAL,
+                transfer_rate_mbps REAL,
+                client_id TEXT,
+                status TEXT,
+                system_uptime REAL,
+                extra TEXT
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_timestamp ON metrics (timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_action_timestamp ON metrics (action, timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_client_timestamp ON metrics (client_id, timestamp)")
+        conn.commit()
+    
+    def add(self, metric: Dict, source: str):
+        """
+        Purpose: Queue a metric for the writer thread. Never blocks: if the queue is full the metric is dropped.
+        
+        Parameters:
+            metric: Metric dict as built by NetworkAnalysisModule
+            source: Origin of the metric (e.g. 'server')
+        """
+        extra = {k: v for k, v in metric.items() if k not in METRIC_COLUMNS and k != 'file_size_mb'}
+        row = (metric['timestamp'], source, metric['action'], metric.get('filename'), metric.get('file_size_bytes', 0),
+               metric.get('duration_seconds', 0), metric.get('transfer_rate_mbps', 0), metric.get('client_id'),
+               metric.get('status'), metric.get('system_uptime'), json.dumps(extra) if extra else None)
+        self._ensure_writer()
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+    
+    def _ensure_writer(self):
+        """
+        Purpose: Start the writer thread on first use (in each process, after a fork), and again if it died
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            if self.pid != os.getpid():
+                # Forked: the parent's queue, batch and connection belong to the parent
+                self.pid = os.getpid()
+                self.queue = queue.Queue(maxsize=self.max_pending)
+                self.pending = []
+                self.conn = None
+            elif self.thread is not None:
+                log.error("Metrics history writer died, restarting it")
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+    
+    def _run(self):
+        """
+        Purpose: Writer thread, batches queued rows and serves flush/close requests
+        """
+        while True:
+            if self.pending:
+                due = self.retry_at if self.failing else self.last_flush + self.flush_interval
+                timeout = max(0.0, due - time.time())
+            else:
+                timeout = None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush_unsafe()
+                continue
+            
+            if isinstance(item, tuple):
+                self.pending.append(item)
+                if len(self.pending) > self.max_pending:
+                    # Only happens while writes are failing, oldest goes first
+                    del self.pending[0]
+                    with self.lock:
+                        self.dropped += 1
+                if len(self.pending) >= self.batch_size and time.time() >= self.retry_at:
+                    self._flush_unsafe()
+                continue
+            
+            done, stop = item
+            self._flush_unsafe()
+            if stop:
+                lost = len(self.pending)
+                with self.lock:
+                    lost, self.dropped = lost + self.dropped, 0
+                if lost:
+                    log.error("Metrics history %s: %d metrics could not be written", self.db_path, lost)
+                self.pending = []
+                if self.conn is not None:
+                    self.conn.close()
+                    self.conn = None
+                done.set()
+                return
+            done.set()
+    
+    def _flush_unsafe(self):
+        """
+        Purpose: Write buffered metrics in one transaction. Writer thread only.
+        Errors are logged, never raised: a failing history must not take the writer down.
+        """
+        self.last_flush = time.time()
+        if not self.pending:
+            return
+        try:
+            self._connect_unsafe()
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO metrics (timestamp, source, action, filename, file_size_bytes, duration_seconds, "
+                    "transfer_rate_mbps, client_id, status, system_uptime, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    self.pending)
+        except sqlite3.Error as e:
+            # Keep the batch for a later try (e.g. "database is locked"), _run caps how much piles up
+            if not self.failing:
+                log.error("Error writing metrics history %s: %s", self.db_path, e)
+            self.failing = True
+            self.retry_at = self.last_flush + self.flush_interval
+            return
+        if self.failing:
+            with self.lock:
+                dropped, self.dropped = self.dropped, 0
+            log.info("Metrics history %s writable again (%d metrics dropped meanwhile)", self.db_path, dropped)
+            self.failing = False
+        self.pending = []
+    
+    def _request(self, stop: bool):
+        """
+        Purpose: Have the writer flush (and with stop, close) and wait until it has
+        """
+        self._ensure_writer()
+        done = threading.Event()
+        self.queue.put([done, stop]) # blocking: has to get in even when the queue is full
+        # If the writer died with our request still queued, a new one picks it up
+        while not done.wait(1.0):
+            self._ensure_writer()
+    
+    def flush(self):
+        """
+        Purpose: Write any buffered metrics now (waits for the writer thread)
+        """
+        if self.thread is None or self.pid != os.getpid():
+            return # nothing was ever queued in this process
+        self._request(stop=False)
+    
+    def close(self):
+        """
+        Purpose: Flush and close the database, stopping the writer thread
+        """
+        if self.thread is None or self.pid != os.getpid():
+            return # nothing was ever queued in this process
+        self._request(stop=True)
+        self.thread.join()
+        self.thread = None
+    
+    @staticmethod
+    def _where(start=None, end=None, client_ids: Optional[List[str]]=None, source: Optional[str]=None, actions: Optional[List[str]]=None):
+        """
+        Purpose: Build a WHERE clause (and its parameters) for the query filters
+        """
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start.isoformat() if isinstance(start, datetime) else start)
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(end.isoformat() if isinstance(end, datetime) else end)
+        if client_ids:
+            clauses.append(f"client_id IN ({','.join('?' * len(client_ids))})")
+            params.extend(client_ids)
+        if source is not None:
+            clauses.append("source = ?")
+            params.append(source)
+        if actions:
+            clauses.append(f"action IN ({','.join('?' * len(actions))})")
+            params.extend(actions)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+    
+    def _query(self, sql: str, params: List) -> List[tuple]:
+        # Own connection, the writer's belongs to the writer thread
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            self._create_schema(conn)
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+    
+    def query_statistics(self, start=None, end=None, client_ids: Optional[List[str]]=None, source: Optional[str]=None) -> Dict:
+        """
+        Purpose: get_statistics-style aggregates over any time range/clients, computed inside SQLite
+        
+        Parameters:
+            start: Earliest timestamp included (datetime or ISO string), None = beginning
+            end: Timestamp to stop before (datetime or ISO string), None = now
+            client_ids: Only these clients, None = all
+            source: Only metrics from this source (e.g. 'server'), None = all
+        
+        Returns:
+            stats: Dictionary holding statistics
+        """
+        self.flush() # include anything still queued
+        where, params = self._where(start, end, client_ids, source)
+        total, first, last, clients = self._query(
+            f"SELECT COUNT(*), MIN(timestamp), MAX(timestamp), COUNT(DISTINCT client_id) FROM metrics{where}", params)[0]
+        if not total:
+            return {"error": "No metrics in range"}
+        
+        stats = {
+            'total_actions': total,
+            'first_timestamp': first,
+            'last_timestamp': last,
+            'distinct_clients': clients
+        }
+        
+        # Upload/download statistics
+        where, params = self._where(start, end, client_ids, source, ['upload', 'download'])
+        rows = self._query(
+            "SELECT action, COUNT(*), AVG(transfer_rate_mbps), MAX(transfer_rate_mbps), MIN(transfer_rate_mbps), "
+            f"AVG(duration_seconds), SUM(file_size_bytes) FROM metrics{where} GROUP BY action", params)
+        transfer_count, transfer_bytes, rate_sum, duration_sum = 0, 0, 0.0, 0.0
+        for action, count, avg_rate, max_rate, min_rate, avg_time, total_bytes in rows:
+            stats[f'{action}_stats'] = {
+                'count': count,
+                'avg_rate_mbps': round(avg_rate, 4),
+                'max_rate_mbps': round(max_rate, 4),
+                'min_rate_mbps': round(min_rate, 4),
+                'avg_transfer_time': round(avg_time, 4),
+                'total_data_mb': round(total_bytes / (2**20), 2)
+            }
+            transfer_count += count
+            transfer_bytes += total_bytes
+            rate_sum += avg_rate * count
+            duration_sum += avg_time * count
+        if transfer_count:
+            stats['overall_transfer_stats'] = {
+                'avg_rate_mbps': round(rate_sum / transfer_count, 4),
+                'total_data_transferred_mb': round(transfer_bytes / (2**20), 2),
+                'avg_transfer_time': round(duration_sum / transfer_count, 4)
+            }
+        
+        # Authentication statistics
+        where, params = self._where(start, end, client_ids, source, ['auth_success', 'auth_fail'])
+        rows = self._query(f"SELECT action, COUNT(*), AVG(duration_seconds) FROM metrics{where} GROUP BY action", params)
+        if rows:
+            counts = {action: count for action, count, _ in rows}
+            attempts = sum(counts.values())
+            stats['authentication_stats'] = {
+                'total_attempts': attempts,
+                'successful': counts.get('auth_success', 0),
+                'failed': counts.get('auth_fail', 0),
+                'avg_response_time': round(sum(count * avg for _, count, avg in rows) / attempts, 4)
+            }
+        
+        return stats
+    
+    def iter_metrics(self, start=None, end=None, client_ids: Optional[List[str]]=None, source: Optional[str]=None,
+                     actions: Optional[List[str]]=None, chunksize: int=100_000) -> Iterator[pd.DataFrame]:
+        """
+        Purpose: Stream raw metrics matching the filters as DataFrame chunks (bounded memory)
+        
+        Parameters:
+            start, end, client_ids, source: Same as query_statistics
+            actions: Only these actions, None = all
+            chunksize: Rows per DataFrame
+        """
+        self.flush()
+        where, params = self._where(start, end, client_ids, source, actions)
+        # Separate read-only connection, so a long scan doesn't hold up writers
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            for chunk in pd.read_sql_query(f"SELECT * FROM metrics{where} ORDER BY timestamp", conn, params=params, chunksize=chunksize):
+                yield chunk
+        finally:
+            conn.close()
 
 class NetworkAnalysisModule:
-    def __init__(self, source: str='unspecified', verbose: bool=True):
+    def __init__(self, source: str='unspecified', verbose: bool=True, db_path: Optional[str]=None):
         '''
         Purpose: Initialize NetworkAnalysisModule object and its attributes
 
         Parameters:
             source: Specifies origin of object call (e.g. 'client' or 'server')
-            verbose: Whether statements are printed to console
+            verbose: Whether statements are logged
+            db_path: Also keep every metric in this SQLite history (see MetricsStore), None = off
         '''
         self.metrics: List[Dict] = [] # e.g. [{'action': 'upload', 'filename': 'example.txt', ...}, ...]
         self.metrics_lock = threading.Lock()  # Protect metrics from race conditions
+        self.counters: Dict[str, Dict[str, int]] = {} # e.g. {'content_cache': {'hits': 10, 'misses': 2, ...}, ...}
+        self.gauges: Dict[str, Dict[str, Dict]] = {} # e.g. {'admission': {'queue_depth': {'current': 3, 'max': 12}}}
+        # Counters/gauges are hit on hot paths (cache hits), so they don't wait behind metrics_lock's file saves
+        self.counters_lock = threading.Lock()
+        self.merged_from: List[str] = [] # metric files pulled in by merge_reports, so offline analysis skips them
 
         self.start_time = time.time()
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -28,14 +379,16 @@ class NetworkAnalysisModule:
 
         self.json_file = os.path.join(self.report_folder, f"{source}_metrics_{timestamp}.json")
         self.csv_file = os.path.join(self.report_folder, f"{source}_metrics_{timestamp}.csv")
+        self.counters_file = os.path.join(self.report_folder, f"{source}_counters_{timestamp}.json")
 
         self.source = source
         self.verbose = verbose
+        self.store = MetricsStore(db_path) if db_path else None
 
         if self.verbose:
-            print(f"[ANALYSIS] {source.upper()} analysis started. Metrics will be saved to {self.json_file}") # DEBUG
+            log.info("%s analysis started. Metrics will be saved to %s", source.upper(), self.json_file)
     
-    def record_action(self, action_type: str, filename: str, file_size: int, duration: float, client_id: str, status: str="success"):
+    def record_action(self, action_type: str, filename: str, file_size: int, duration: float, client_id: str, status: str="success", extra: Optional[Dict]=None):
         """
         Purpose: Record an interaction between client and server along with metrics
         
@@ -46,6 +399,7 @@ class NetworkAnalysisModule:
             duration: Time taken for action (in seconds)
             client_id: Client indentifier
             status: Success or failure status
+            extra: Additional per-action measurements (e.g. {'throttle_seconds': 0.5})
         """
         # Calculate transfer rate (MB/sec)
         if duration > 0:
@@ -66,17 +420,23 @@ class NetworkAnalysisModule:
             'status': status,
             'system_uptime': round(time.time() - self.start_time, 2)
         }
+        if extra:
+            metric.update(extra)
         
         # Acquire lock and insert metric
         with self.metrics_lock:
             self.metrics.append(metric)
             if len(self.metrics) % 10 == 0: # Save for every 10 actions (unsafe, as lock is already obtained)
                 self._save_metrics_unsafe()
+        if self.store:
+            self.store.add(metric, self.source)
         
         if self.verbose:
-            print(f"[ANALYSIS] Recorded {action_type}: {filename} ({transfer_rate_mbps:.2f} MB/s, {duration:.2f}s)")
+            # One per request, so sampled/rate limited (formatted later on the log thread)
+            log.info("Recorded %s: %s (%.2f MB/s, %.2fs)", action_type, filename, transfer_rate_mbps, duration,
+                     extra={'metric': metric, 'sampled': True})
     
-    def record_connection(self, client_id: str, event_type: str, response_time: Optional[float]=None):
+    def record_connection(self, client_id: str, event_type: str, response_time: Optional[float]=None, extra: Optional[Dict]=None):
         """
         Purpose: Record connection event
         
@@ -84,6 +444,7 @@ class NetworkAnalysisModule:
             client_id: Identifier for the client
             event_type: Type of event (connect, disconnect, auth_success, auth_fail)
             response_time: System response time for authentication
+            extra: Additional measurements (e.g. {'auth_method': 'token'})
         """
         # Dict of metrics for connection
         metric = {
@@ -98,13 +459,93 @@ class NetworkAnalysisModule:
             'status': 'success' if 'success' in event_type else 'info',
             'system_uptime': round(time.time() - self.start_time, 2)
         }
+        if extra:
+            metric.update(extra)
         
         # Acquire lock and insert metric
         with self.metrics_lock:
             self.metrics.append(metric)
+        if self.store:
+            self.store.add(metric, self.source)
         
         if self.verbose:
-            print(f"[ANALYSIS] Recorded {event_type}: {client_id}")
+            log.info("Recorded %s: %s", event_type, client_id, extra={'metric': metric, 'sampled': True})
+    
+    def record_counter(self, group: str, name: str, amount: int=1):
+        """
+        Purpose: Increment a named counter. Used for high-volume events (e.g. cache hits) that
+        shouldn't each get their own metrics row
+        
+        Parameters:
+            group: Counter group (e.g. content_cache)
+            name: Counter within the group (e.g. hits, misses, bytes_served, evictions)
+            amount: Amount to add
+        """
+        with self.counters_lock:
+            group_counters = self.counters.setdefault(group, {})
+            group_counters[name] = group_counters.get(name, 0) + amount
+    
+    def record_gauge(self, group: str, name: str, value: float):
+        """
+        Purpose: Record the current value of a gauge (e.g. queue depth), keeping its peak
+        
+        Parameters:
+            group: Gauge group (e.g. admission)
+            name: Gauge within the group (e.g. queue_depth)
+            value: Current value
+        """
+        with self.counters_lock:
+            gauge = self.gauges.setdefault(group, {}).setdefault(name, {'current': value, 'max': value})
+            gauge['current'] = value
+            gauge['max'] = max(gauge['max'], value)
+    
+    def network_estimates(self, window: int=200, min_transfer_bytes: int=2**20) -> Dict:
+        """
+        Purpose: Current link estimates from recent metrics, for sizing socket buffers
+        
+        Parameters:
+            window: How many of the latest metrics to look at
+            min_transfer_bytes: Smaller transfers finish before TCP ramps up, so they're ignored for throughput
+        
+        Returns:
+            estimates: {'rtt_seconds': median connect RTT, 'throughput_bps': 90th percentile transfer rate (bytes/sec)},
+            either None when nothing has been measured yet
+        """
+        with self.metrics_lock:
+            recent = self.metrics[-window:]
+        
+        rtts = sorted(m['rtt_ms'] for m in recent if m['action'] == 'connect' and m.get('rtt_ms') is not None)
+        rates = sorted(m['transfer_rate_mbps'] for m in recent
+                       if m['action'] in ('upload', 'download') and m['status'] == 'success'
+                       and m['file_size_bytes'] >= min_transfer_bytes and m['transfer_rate_mbps'] > 0)
+        return {
+            'rtt_seconds': rtts[len(rtts) // 2] / 1000 if rtts else None,
+            'throughput_bps': rates[int(len(rates) * 0.9)] * (2**20) if rates else None
+        }
+    
+    def _copy_counters(self):
+        """
+        Purpose: Consistent copies of the counters and gauges (taken under counters_lock)
+        """
+        with self.counters_lock:
+            counters = {group: dict(values) for group, values in self.counters.items()}
+            gauges = {group: {name: dict(g) for name, g in values.items()} for group, values in self.gauges.items()}
+        return counters, gauges
+    
+    @staticmethod
+    @contextmanager
+    def _replacing(path: str):
+        """
+        Purpose: Write to a temp file next to path and swap it in at the end, so readers
+        (the prefork parent, the offline analyzer) never see a half written report
+        """
+        tmp = path + ".tmp"
+        try:
+            yield tmp
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
     
     def _save_metrics_unsafe(self):
         """
@@ -112,16 +553,29 @@ class NetworkAnalysisModule:
         """
         try:
             # Save as JSON
-            with open(self.json_file, 'w') as f:
-                json.dump(self.metrics, f, indent=2)
+            with self._replacing(self.json_file) as tmp:
+                with open(tmp, 'w') as f:
+                    json.dump(self.metrics, f, indent=2)
             
             # Save as CSV
             if self.metrics:
                 df = pd.DataFrame(self.metrics)
-                df.to_csv(self.csv_file, index=False)
+                with self._replacing(self.csv_file) as tmp:
+                    df.to_csv(tmp, index=False)
+            
+            # Save counters and gauges (and which metric files this run's report already includes,
+            # and which history db also has this run's own metrics)
+            counters, gauges = self._copy_counters()
+            if counters or gauges or self.merged_from or self.store:
+                saved = {'counters': counters, 'gauges': gauges, 'merged': self.merged_from}
+                if self.store:
+                    saved['history'] = os.path.basename(self.store.db_path)
+                with self._replacing(self.counters_file) as tmp:
+                    with open(tmp, 'w') as f:
+                        json.dump(saved, f, indent=2)
         except Exception as e:
             if self.verbose:
-                print(f"[ANALYSIS] Error saving metrics: {e}")
+                log.error("Error saving metrics: %s", e)
     
     def save_metrics(self):
         """
@@ -130,8 +584,68 @@ class NetworkAnalysisModule:
         # Acquire lock and save metrics (safe)
         with self.metrics_lock:
             self._save_metrics_unsafe()
+        if self.store:
+            self.store.flush()
         if self.verbose:
-            print(f"[ANALYSIS] Metrics saved to {self.json_file} and {self.csv_file}")
+            log.info("Metrics saved to %s and %s", self.json_file, self.csv_file)
+    
+    def merge_reports(self, json_files: List[str], counters_files: Optional[List[str]]=None):
+        """
+        Purpose: Pull metrics saved by other analyzers (e.g. prefork server workers) into this one,
+        so a single report covers all of them
+        
+        Parameters:
+            json_files: Metrics JSON files written by save_metrics
+            counters_files: Matching counters files, if any
+        """
+        merged = []
+        merged_stems = []
+        for path in json_files:
+            loaded = self._load_report(path)
+            if loaded is not None:
+                merged.extend(loaded)
+                merged_stems.append(os.path.splitext(os.path.basename(path))[0])
+        merged.sort(key=lambda m: m['timestamp'])
+        
+        loaded_counters = []
+        for path in counters_files or []:
+            loaded = self._load_report(path)
+            if loaded is not None:
+                loaded_counters.append(loaded)
+        
+        with self.metrics_lock:
+            self.metrics.extend(merged)
+            # Only what was actually read, so the offline analyzer still picks up anything skipped
+            self.merged_from.extend(merged_stems)
+        with self.counters_lock:
+            for saved in loaded_counters:
+                for group, values in saved.get('counters', {}).items():
+                    group_counters = self.counters.setdefault(group, {})
+                    for name, amount in values.items():
+                        group_counters[name] = group_counters.get(name, 0) + amount
+                for group, values in saved.get('gauges', {}).items():
+                    for name, gauge in values.items():
+                        current = self.gauges.setdefault(group, {}).setdefault(name, dict(gauge))
+                        current['max'] = max(current['max'], gauge['max'])
+        
+        if self.verbose:
+            log.info("Merged %d metrics from %d reports", len(merged), len(merged_stems))
+    
+    def _load_report(self, path: str):
+        """
+        Purpose: Read one saved JSON report for merge_reports
+        
+        Returns:
+            The parsed JSON, or None if the file is missing or unreadable (e.g. a worker killed mid-write)
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            log.error("Skipping unreadable report %s: %s", path, e)
+            return None
     
     def get_statistics(self):
         """
@@ -145,6 +659,7 @@ class NetworkAnalysisModule:
             if not self.metrics:
                 return {"error": "No metrics collected yet"}
             metrics_copy = self.metrics.copy()
+        counters_copy, gauges_copy = self._copy_counters()
         
         df = pd.DataFrame(metrics_copy)
         
@@ -188,6 +703,41 @@ class NetworkAnalysisModule:
                 'avg_transfer_time': round(transfer_actions['duration_seconds'].mean(), 4)
             }
         
+        # Durability statistics (fsync cost per upload)
+        if 'fsync_seconds' in df.columns:
+            synced = df[(df['action'] == 'upload') & (df['status'] == 'success') & df['fsync_seconds'].notna()]
+            if not synced.empty:
+                stats['durability_stats'] = {
+                    'uploads': len(synced),
+                    'avg_fsync_time': round(synced['fsync_seconds'].mean(), 4),
+                    'max_fsync_time': round(synced['fsync_seconds'].max(), 4),
+                    'total_fsync_time': round(synced['fsync_seconds'].sum(), 4)
+                }
+        
+        # Integrity statistics (streaming checksums)
+        if 'hash_seconds' in df.columns:
+            hashed = df[df['action'].isin(['upload', 'download']) & df['hash_seconds'].notna()]
+            if not hashed.empty:
+                uploads_checked = hashed[hashed['action'] == 'upload']
+                downloads_checked = hashed[hashed['action'] == 'download']
+                stats['integrity_stats'] = {
+                    'checksum_mismatches': int((uploads_checked['checksum_ok'] == False).sum()) if 'checksum_ok' in hashed.columns else 0,
+                    'downloads_from_stored_digest': int((downloads_checked['stored_digest'] == True).sum()) if 'stored_digest' in hashed.columns else 0,
+                    'avg_hash_time': round(hashed['hash_seconds'].mean(), 4),
+                    'avg_hash_wait': round(hashed['hash_wait_seconds'].mean(), 4),
+                    'total_hash_time': round(hashed['hash_seconds'].sum(), 4)
+                }
+        
+        # Throttling statistics (time transfers spent waiting on the bandwidth scheduler)
+        if 'throttle_seconds' in df.columns:
+            throttled = df[df['throttle_seconds'].fillna(0) > 0]
+            stats['throttle_stats'] = {
+                'throttled_transfers': len(throttled),
+                'total_throttle_time': round(df['throttle_seconds'].fillna(0).sum(), 4),
+                'avg_throttle_time': round(throttled['throttle_seconds'].mean(), 4) if not throttled.empty else 0,
+                'max_throttle_time': round(throttled['throttle_seconds'].max(), 4) if not throttled.empty else 0
+            }
+        
         # Authentication statistics
         connections = df[df['action'].isin(['connect', 'auth_success', 'auth_fail'])]
         if not connections.empty:
@@ -199,6 +749,76 @@ class NetworkAnalysisModule:
                     'failed': len(auth_ops[auth_ops['action'] == 'auth_fail']),
                     'avg_response_time': round(auth_ops['duration_seconds'].mean(), 4)
                 }
+                
+                # Password (CONNECT) vs session token (RESUME)
+                if 'auth_method' in auth_ops.columns:
+                    by_method = {}
+                    for method, group in auth_ops.groupby('auth_method'):
+                        by_method[method] = {
+                            'attempts': len(group),
+                            'successful': len(group[group['action'] == 'auth_success']),
+                            'failed': len(group[group['action'] == 'auth_fail']),
+                            'avg_response_time': round(group['duration_seconds'].mean(), 6)
+                        }
+                    stats['authentication_stats']['by_method'] = by_method
+        
+        # Socket statistics (RTT seen at accept and the buffer sizes each connection ended up with)
+        if 'rtt_ms' in df.columns:
+            tuned = df[(df['action'] == 'connect') & df['rtt_ms'].notna()]
+            if not tuned.empty:
+                stats['socket_stats'] = {
+                    'profiles': sorted(tuned['socket_profile'].dropna().unique().tolist()) if 'socket_profile' in tuned.columns else [],
+                    'connections': len(tuned),
+                    'avg_rtt_ms': round(tuned['rtt_ms'].mean(), 3),
+                    'median_rtt_ms': round(tuned['rtt_ms'].median(), 3),
+                    'max_rtt_ms': round(tuned['rtt_ms'].max(), 3),
+                    'avg_sndbuf_kb': round(tuned['sndbuf'].mean() / 1024, 1) if 'sndbuf' in tuned.columns else 0,
+                    'avg_rcvbuf_kb': round(tuned['rcvbuf'].mean() / 1024, 1) if 'rcvbuf' in tuned.columns else 0
+                }
+        
+        # Change notification statistics (SUBSCRIBE feed)
+        notifications = counters_copy.get('notifications', {})
+        if notifications:
+            subscribers = gauges_copy.get('notifications', {}).get('subscribers', {})
+            stats['notification_stats'] = {
+                'events_published': notifications.get('events_published', 0),
+                'events_sent': notifications.get('events_sent', 0),
+                'snapshots': notifications.get('snapshots', 0),
+                'dropped_subscribers': notifications.get('dropped_subscribers', 0),
+                'max_subscribers': subscribers.get('max', 0)
+            }
+        
+        # Admission control statistics (queue wait, depth, rejections)
+        admission = counters_copy.get('admission', {})
+        waits = df[df['action'] == 'queue_wait']
+        if admission or not waits.empty:
+            queue_depth = gauges_copy.get('admission', {}).get('queue_depth', {})
+            stats['admission_stats'] = {
+                'admitted': admission.get('admitted', 0),
+                'rejected': admission.get('rejected', 0),
+                'idle_timeouts': admission.get('idle_timeouts', 0),
+                'avg_queue_wait': round(waits['duration_seconds'].mean(), 4) if not waits.empty else 0,
+                'max_queue_wait': round(waits['duration_seconds'].max(), 4) if not waits.empty else 0,
+                'max_queue_depth': queue_depth.get('max', 0)
+            }
+        
+        # Cache statistics (any counter group that tracks hits/misses)
+        cache_stats = {}
+        for group, values in counters_copy.items():
+            if 'hits' not in values and 'misses' not in values:
+                continue
+            hits = values.get('hits', 0)
+            misses = values.get('misses', 0)
+            cache_stats[group] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else 0,
+                'bytes_served_mb': round(values.get('bytes_served', 0) / (2**20), 2),
+                'evictions': values.get('evictions', 0),
+                'invalidations': values.get('invalidations', 0)
+            }
+        if cache_stats:
+            stats['cache_stats'] = cache_stats
         
         return stats
     
@@ -249,18 +869,102 @@ class NetworkAnalysisModule:
             else:
                 f.write("No downloads recorded.\n\n\n")
             
+            f.write("-- DURABILITY SUMMARY --\n")
+            if 'durability_stats' in stats:
+                dus = stats['durability_stats']
+                f.write(f"Uploads Committed: {dus['uploads']}\n")
+                f.write(f"Average fsync Time: {dus['avg_fsync_time']:.4f} seconds\n")
+                f.write(f"Maximum fsync Time: {dus['max_fsync_time']:.4f} seconds\n")
+                f.write(f"Total fsync Time: {dus['total_fsync_time']:.4f} seconds\n\n\n")
+            else:
+                f.write("No uploads committed.\n\n\n")
+            
+            f.write("-- INTEGRITY SUMMARY --\n")
+            if 'integrity_stats' in stats:
+                ins = stats['integrity_stats']
+                f.write(f"Checksum Mismatches: {ins['checksum_mismatches']}\n")
+                f.write(f"Downloads Using Stored Digest: {ins['downloads_from_stored_digest']}\n")
+                f.write(f"Average Hash Time: {ins['avg_hash_time']:.4f} seconds\n")
+                f.write(f"Average Hash Wait (on transfer path): {ins['avg_hash_wait']:.4f} seconds\n")
+                f.write(f"Total Hash Time: {ins['total_hash_time']:.4f} seconds\n\n\n")
+            else:
+                f.write("No checksums recorded.\n\n\n")
+            
+            f.write("-- THROTTLE SUMMARY --\n")
+            if 'throttle_stats' in stats:
+                ts = stats['throttle_stats']
+                f.write(f"Throttled Transfers: {ts['throttled_transfers']}\n")
+                f.write(f"Total Throttle Time: {ts['total_throttle_time']:.4f} seconds\n")
+                f.write(f"Average Throttle Time: {ts['avg_throttle_time']:.4f} seconds\n")
+                f.write(f"Maximum Throttle Time: {ts['max_throttle_time']:.4f} seconds\n\n\n")
+            else:
+                f.write("No throttling recorded.\n\n\n")
+            
             f.write("-- AUTHENTICATION SUMMARY --\n")
             if 'authentication_stats' in stats:
                 aus = stats['authentication_stats']
                 f.write(f"Total Auth Attempts: {aus['total_attempts']}\n")
                 f.write(f"Successful: {aus['successful']}\n")
                 f.write(f"Failed: {aus['failed']}\n")
-                f.write(f"Average Response Time: {aus['avg_response_time']:.4f} seconds")
+                f.write(f"Average Response Time: {aus['avg_response_time']:.4f} seconds\n")
+                for method, ms in aus.get('by_method', {}).items():
+                    f.write(f"  [{method}] {ms['attempts']} attempts, {ms['successful']} ok, {ms['failed']} failed, "
+                            f"avg {ms['avg_response_time']:.6f} seconds\n")
+                f.write("\n\n")
             else:
                 f.write("No authentications recorded.\n\n\n")
+            
+            f.write("-- SOCKET SUMMARY --\n")
+            if 'socket_stats' in stats:
+                ss = stats['socket_stats']
+                f.write(f"Profiles: {', '.join(ss['profiles'])}\n")
+                f.write(f"Connections Measured: {ss['connections']}\n")
+                f.write(f"Average RTT: {ss['avg_rtt_ms']:.3f} ms\n")
+                f.write(f"Median RTT: {ss['median_rtt_ms']:.3f} ms\n")
+                f.write(f"Maximum RTT: {ss['max_rtt_ms']:.3f} ms\n")
+                f.write(f"Average Send Buffer: {ss['avg_sndbuf_kb']:.1f} KB\n")
+                f.write(f"Average Receive Buffer: {ss['avg_rcvbuf_kb']:.1f} KB\n\n\n")
+            else:
+                f.write("No socket measurements recorded.\n\n\n")
+            
+            f.write("-- NOTIFICATION SUMMARY --\n")
+            if 'notification_stats' in stats:
+                ns = stats['notification_stats']
+                f.write(f"Events Published: {ns['events_published']}\n")
+                f.write(f"Events Pushed: {ns['events_sent']}\n")
+                f.write(f"Snapshots Sent: {ns['snapshots']}\n")
+                f.write(f"Dropped Subscribers: {ns['dropped_subscribers']}\n")
+                f.write(f"Maximum Subscribers: {ns['max_subscribers']}\n\n\n")
+            else:
+                f.write("No change notifications recorded.\n\n\n")
+            
+            f.write("-- ADMISSION SUMMARY --\n")
+            if 'admission_stats' in stats:
+                ads = stats['admission_stats']
+                f.write(f"Admitted Connections: {ads['admitted']}\n")
+                f.write(f"Rejected Connections: {ads['rejected']}\n")
+                f.write(f"Idle Timeouts: {ads['idle_timeouts']}\n")
+                f.write(f"Average Queue Wait: {ads['avg_queue_wait']:.4f} seconds\n")
+                f.write(f"Maximum Queue Wait: {ads['max_queue_wait']:.4f} seconds\n")
+                f.write(f"Maximum Queue Depth: {ads['max_queue_depth']}\n\n\n")
+            else:
+                f.write("No admission activity recorded.\n\n\n")
+            
+            f.write("-- CACHE SUMMARY --\n")
+            if 'cache_stats' in stats:
+                for group, cs in stats['cache_stats'].items():
+                    f.write(f"[{group}]\n")
+                    f.write(f"Hits: {cs['hits']}\n")
+                    f.write(f"Misses: {cs['misses']}\n")
+                    f.write(f"Hit Ratio: {cs['hit_ratio']:.4f}\n")
+                    f.write(f"Data Served From Cache: {cs['bytes_served_mb']:.2f} MB\n")
+                    f.write(f"Evictions: {cs['evictions']}\n")
+                    f.write(f"Invalidations: {cs['invalidations']}\n\n")
+            else:
+                f.write("No cache activity recorded.\n\n\n")
         
         if self.verbose:
-            print(f"[Analyzer] Report generated: {output_file}")
+            log.info("Report generated: %s", output_file)
 
         return output_file
     
@@ -269,4 +973,288 @@ class NetworkAnalysisModule:
         Purpose: Save metrics and generate final .txt report
         """
         self.save_metrics()
-        self.generate_report_txt()
\ No newline at end of file
+        self.generate_report_txt()
+        if self.store:
+            self.store.close()
+
+
+# OFFLINE ANALYSIS ------------------------------------------>
+
+# Only these columns are read from archives, everything else is skipped at parse time
+OFFLINE_COLUMNS = ['timestamp', 'action', 'file_size_bytes', 'duration_seconds', 'client_id', 'status']
+
+# Fixed log-spaced latency bins (1us .. ~3h, then one overflow bin), so percentiles come from
+# histograms merged chunk by chunk
+LATENCY_BINS = np.concatenate(([0.0], np.logspace(-6, 4, 401), [np.inf]))
+
+def _expand_archive_paths(paths: List[str]) -> List[str]:
+    """
+    Purpose: Turn files/folders into a list of metric archives, each metric read once. In folders,
+    the counters files say what to skip:
+    - runs whose own metrics went into a .db (MetricsStore) in the same folder, which is read instead
+    - a run's .json is skipped when its .csv twin exists (same data)
+    - files another run's report merged in (prefork workers) are skipped, unless that report is
+      itself skipped for being in a .db (which only has that run's own metrics)
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        jsonl = sorted(glob.glob(os.path.join(path, "*.jsonl")))
+        dbs = sorted(glob.glob(os.path.join(path, "*.db")))
+        db_names = {os.path.basename(db) for db in dbs}
+        
+        in_db = set() # run stems whose own metrics are in one of dbs
+        merged_into = {} # merged run stem -> stem of the report that includes it
+        for counters_file in glob.glob(os.path.join(path, "*_counters_*.json")):
+            try:
+                with open(counters_file) as f:
+                    saved = json.load(f)
+                run = os.path.splitext(os.path.basename(counters_file))[0].replace('_counters_', '_metrics_', 1)
+                if saved.get('history') in db_names:
+                    in_db.add(run)
+                for stem in saved.get('merged', []):
+                    merged_into[stem] = run
+            except (OSError, ValueError, AttributeError):
+                continue
+        
+        files.extend(dbs)
+        for f in sorted(glob.glob(os.path.join(path, "*_metrics_*.*"))):
+            stem, ext = os.path.splitext(f)
+            name = os.path.basename(stem)
+            if name in in_db:
+                continue
+            if name in merged_into and merged_into[name] not in in_db:
+                continue
+            if ext == '.json' and os.path.exists(stem + '.csv'):
+                continue
+            if ext in ('.json', '.csv'):
+                files.append(f)
+        files.extend(jsonl)
+    return files
+
+def _iter_archive_chunks(path: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Purpose: Read one archive as DataFrame chunks of at most chunksize rows
+    
+    Parameters:
+        path: .csv / .jsonl / .json (list of metrics, as written by save_metrics) / .db (MetricsStore)
+        chunksize: Rows per chunk
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        yield from pd.read_csv(path, usecols=lambda c: c in OFFLINE_COLUMNS, chunksize=chunksize)
+    elif ext == '.jsonl':
+        for chunk in pd.read_json(path, lines=True, chunksize=chunksize):
+            yield chunk[[c for c in OFFLINE_COLUMNS if c in chunk.columns]]
+    elif ext == '.db':
+        for chunk in MetricsStore(path).iter_metrics(chunksize=chunksize):
+            yield chunk[OFFLINE_COLUMNS]
+    elif ext == '.json':
+        # save_metrics writes one JSON array per run, which has to be parsed whole
+        with open(path) as f:
+            records = json.load(f)
+        if not isinstance(records, list):
+            return
+        for i in range(0, len(records), chunksize):
+            chunk = pd.DataFrame.from_records(records[i:i + chunksize])
+            yield chunk[[c for c in OFFLINE_COLUMNS if c in chunk.columns]]
+
+def analyze_archives(paths: List[str], output_file: Optional[str]=None, bucket: str='1min',
+                     chunksize: int=1_000_000, top_n: int=10, verbose: bool=True) -> Dict:
+    """
+    Purpose: Consolidated report over many metric archives (e.g. a week of server runs). Each chunk is
+    reduced with vectorized groupbys into small running totals, so memory stays bounded no matter how
+    many records there are
+    
+    Parameters:
+        paths: Archive files and/or folders (e.g. analysis_reports)
+        output_file: .txt report path, None = analysis_reports/offline_report_<timestamp>.txt
+        bucket: Time bucket for the throughput/error trends (pandas offset, e.g. '1min', '1h')
+        chunksize: Rows parsed at a time
+        top_n: How many top talkers to list
+        verbose: Whether statements are logged
+    
+    Returns:
+        stats: Dictionary holding the consolidated statistics
+    """
+    start_time = time.time()
+    files = _expand_archive_paths(paths)
+    bucket_seconds = pd.Timedelta(bucket).total_seconds()
+    
+    # Running totals, all small (one row per bucket/action, client or latency bin)
+    timeline = None # (bucket, action) -> bytes, transfers, duration
+    errors = None # bucket -> actions, failures
+    talkers = None # client ip -> bytes, transfers
+    latency_hist = {} # action -> counts per LATENCY_BINS bin
+    latency_sums = {} # action -> [count, total seconds, max seconds]
+    total_records = 0
+    
+    for path in files:
+        for chunk in _iter_archive_chunks(path, chunksize):
+            ts = pd.to_datetime(chunk['timestamp'], format='ISO8601', errors='coerce')
+            valid = ts.notna()
+            if not valid.all():
+                chunk, ts = chunk[valid], ts[valid]
+            if chunk.empty:
+                continue
+            total_records += len(chunk)
+            
+            buckets = ts.dt.floor(bucket)
+            action = chunk['action']
+            size = chunk['file_size_bytes'].fillna(0)
+            duration = chunk['duration_seconds'].fillna(0)
+            failed = (chunk['status'] == 'failure').astype(np.int64)
+            
+            # Error-rate trend (every action counts)
+            part = pd.DataFrame({'actions': 1, 'failures': failed}).groupby(buckets.values).sum()
+            errors = part if errors is None else errors.add(part, fill_value=0)
+            
+            is_transfer = action.isin(['upload', 'download']).to_numpy()
+            if not is_transfer.any():
+                continue
+            t_action = action[is_transfer]
+            t_size = size[is_transfer]
+            t_duration = duration[is_transfer]
+            
+            # Throughput timeline
+            part = pd.DataFrame({'bytes': t_size.to_numpy(), 'transfers': 1, 'duration': t_duration.to_numpy()},
+                                index=pd.MultiIndex.from_arrays([buckets[is_transfer].values, t_action.values],
+                                                                names=['bucket', 'action']))
+            part = part.groupby(level=['bucket', 'action']).sum()
+            timeline = part if timeline is None else timeline.add(part, fill_value=0)
+            
+            # Top talkers, by client IP (client_id is ip:port, the port changes every connection).
+            # Group on the raw client_id first, so the port is only stripped once per connection
+            client_id = chunk['client_id'][is_transfer].astype(str)
+            part = pd.DataFrame({'bytes': t_size.to_numpy(), 'transfers': 1}, index=client_id.values).groupby(level=0).sum()
+            part = part.groupby(part.index.str.rsplit(':', n=1).str[0]).sum()
+            talkers = part if talkers is None else talkers.add(part, fill_value=0)
+            
+            # Latency distributions
+            for name, durations in t_duration.groupby(t_action.values):
+                values = durations.to_numpy()
+                counts, _ = np.histogram(values, bins=LATENCY_BINS)
+                latency_hist[name] = latency_hist.get(name, 0) + counts
+                sums = latency_sums.setdefault(name, [0, 0.0, 0.0])
+                sums[0] += len(values)
+                sums[1] += float(values.sum())
+                sums[2] = max(sums[2], float(values.max()))
+    
+    stats = {
+        'files': len(files),
+        'total_records': total_records,
+        'bucket': bucket,
+        'elapsed_seconds': round(time.time() - start_time, 2)
+    }
+    
+    def _percentile(counts: np.ndarray, q: float, worst: float) -> float:
+        # Upper edge of the bin holding the q-th percentile, never past the actual max
+        # (which is also what the overflow bin reports)
+        cumulative = np.cumsum(counts)
+        return min(float(LATENCY_BINS[1:][np.searchsorted(cumulative, q * cumulative[-1])]), worst)
+    
+    latency = {}
+    for name, counts in latency_hist.items():
+        count, total, worst = latency_sums[name]
+        latency[name] = {
+            'count': int(count),
+            'avg_seconds': round(total / count, 6),
+            'p50_seconds': round(_percentile(counts, 0.50, worst), 6),
+            'p90_seconds': round(_percentile(counts, 0.90, worst), 6),
+            'p99_seconds': round(_percentile(counts, 0.99, worst), 6),
+            'max_seconds': round(worst, 6)
+        }
+    stats['latency'] = latency
+    
+    if timeline is not None:
+        per_bucket = timeline.unstack('action', fill_value=0)
+        throughput = (per_bucket['bytes'] / (2**20) / bucket_seconds).add_suffix('_mbps')
+        stats['throughput'] = {
+            'total_data_mb': round(float(timeline['bytes'].sum()) / (2**20), 2),
+            'peak_bucket_mbps': round(float(throughput.sum(axis=1).max()), 4),
+            'avg_bucket_mbps': round(float(throughput.sum(axis=1).mean()), 4)
+        }
+        top = talkers.sort_values('bytes', ascending=False).head(top_n)
+        stats['top_talkers'] = [
+            {'client': client, 'data_mb': round(row['bytes'] / (2**20), 2), 'transfers': int(row['transfers'])}
+            for client, row in top.iterrows()
+        ]
+    else:
+        throughput = pd.DataFrame()
+    
+    if errors is not None:
+        error_rate = (errors['failures'] / errors['actions']).rename('error_rate')
+        stats['errors'] = {
+            'total_failures': int(errors['failures'].sum()),
+            'overall_error_rate': round(float(errors['failures'].sum() / errors['actions'].sum()), 4),
+            'worst_bucket': str(error_rate.idxmax()),
+            'worst_bucket_error_rate': round(float(error_rate.max()), 4)
+        }
+        trend = pd.concat([throughput, errors['actions'], error_rate], axis=1).fillna(0).sort_index()
+    else:
+        trend = throughput
+    
+    # Write the report (+ the per-bucket trend as CSV next to it)
+    if output_file is None:
+        report_folder = "analysis_reports"
+        os.makedirs(report_folder, exist_ok=True)
+        output_file = os.path.join(report_folder, f"offline_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    trend_file = os.path.splitext(output_file)[0] + "_timeseries.csv"
+    trend.to_csv(trend_file, index_label='bucket')
+    stats['timeseries_file'] = trend_file
+    
+    with open(output_file, 'w') as f:
+        f.write("-- OFFLINE ANALYSIS REPORT --\n")
+        f.write(f"Archives Read: {stats['files']}\n")
+        f.write(f"Records: {total_records}\n")
+        f.write(f"Time Bucket: {bucket}\n")
+        f.write(f"Analysis Time: {stats['elapsed_seconds']:.2f} seconds\n\n\n")
+        
+        f.write("-- THROUGHPUT --\n")
+        if 'throughput' in stats:
+            tp = stats['throughput']
+            f.write(f"Total Data Transferred: {tp['total_data_mb']:.2f} MB\n")
+            f.write(f"Peak Bucket Throughput: {tp['peak_bucket_mbps']:.4f} MB/sec\n")
+            f.write(f"Average Bucket Throughput: {tp['avg_bucket_mbps']:.4f} MB/sec\n")
+            f.write(f"Per-bucket series: {trend_file}\n\n\n")
+        else:
+            f.write("No transfers recorded.\n\n\n")
+        
+        f.write("-- LATENCY --\n")
+        for name, ls in latency.items():
+            f.write(f"[{name}] count {ls['count']}, avg {ls['avg_seconds']:.6f}s, p50 {ls['p50_seconds']:.6f}s, "
+                    f"p90 {ls['p90_seconds']:.6f}s, p99 {ls['p99_seconds']:.6f}s, max {ls['max_seconds']:.6f}s\n")
+        f.write("\n\n" if latency else "No transfers recorded.\n\n\n")
+        
+        f.write(f"-- TOP {top_n} TALKERS --\n")
+        for t in stats.get('top_talkers', []):
+            f.write(f"{t['client']}: {t['data_mb']:.2f} MB over {t['transfers']} transfers\n")
+        f.write("\n\n" if stats.get('top_talkers') else "No transfers recorded.\n\n\n")
+        
+        f.write("-- ERRORS --\n")
+        if 'errors' in stats:
+            es = stats['errors']
+            f.write(f"Total Failures: {es['total_failures']}\n")
+            f.write(f"Overall Error Rate: {es['overall_error_rate']:.4f}\n")
+            f.write(f"Worst Bucket: {es['worst_bucket']} ({es['worst_bucket_error_rate']:.4f})\n")
+        else:
+            f.write("No actions recorded.\n")
+    
+    stats['report_file'] = output_file
+    if verbose:
+        log.info("Offline report over %d records generated: %s", total_records, output_file)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline analysis of saved metric archives")
+    parser.add_argument("paths", nargs="*", default=["analysis_reports"],
+                        help="metric files (.csv/.json/.jsonl/.db) or folders of them")
+    parser.add_argument("--bucket", default="1min", help="time bucket for trends, e.g. 10s, 1min, 1h")
+    parser.add_argument("--chunksize", type=int, default=1_000_000, help="rows parsed at a time")
+    parser.add_argument("--top", type=int, default=10, help="number of top talkers to list")
+    parser.add_argument("--output", default=None, help="report path (.txt)")
+    args = parser.parse_args()
+    analyze_archives(args.paths, args.output, args.bucket, args.chunksize, args.top)
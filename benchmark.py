@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# Local benchmarks for server tuning. Runs a real server in-process on localhost
+# against a throwaway DATA_DIR, so nothing here touches the real server_data.
+#
+# Usage:
+#   python benchmark.py upload [--size-mb 256] [--count 3]
+#   python benchmark.py sockets [--rtt-ms 40] [--rate-mbit 200] [--size-mb 32] [--link relay|netem]
+import os
+import socket
+import threading
+import hashlib
+import time
+import tempfile
+import shutil
+import atexit
+import argparse
+import queue
+import subprocess
+
+# Payloads and server_data go in here, removed again on exit
+WORK_DIR = tempfile.mkdtemp(prefix="fileserver_bench_")
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    # server.py's analyzer opens ./analysis_reports as soon as it's imported, keep that in here too
+    os.chdir(WORK_DIR)
+
+import server
+
+USER = "bench"
+PASSWORD = "bench"
+CHUNK = 1 * 2**20 # client side send/recv size, big enough that the server is the bottleneck
+
+
+# SERVER ------------------------------------------>
+
+def start_local_server() -> tuple:
+    # Grab a free port
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    server.HOST, server.PORT = "127.0.0.1", port
+    server.ADDR = (server.HOST, server.PORT)
+    server.DATA_DIR = os.path.join(WORK_DIR, "server_data")
+    server.USERS[USER] = server.sha256_hex(PASSWORD)
+    server.analyzer.verbose = False
+    # Keep per-connection log lines out of the result tables
+    server.logutil.setup_logging(level="WARNING")
+
+    threading.Thread(target=server.start_server, daemon=True).start()
+    time.sleep(0.5)
+    return server.ADDR
+
+
+# CLIENT ------------------------------------------>
+
+def connect(addr, tune: bool=False) -> socket.socket:
+    if tune:
+        # Client side of the same server.SOCKET_PROFILE (client.py carries its own copy of this)
+        profile = server.SOCKET_PROFILES.get(server.SOCKET_PROFILE, server.SOCKET_PROFILES["wan"])
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if server.SOCKET_PROFILE != "auto":
+            server._set_buffers(s, profile["sndbuf"], profile["rcvbuf"])
+        s.connect(addr)
+        server._tune_connection(s)
+    else:
+        s = socket.create_connection(addr)
+    s.sendall(f"CONNECT {USER} {hashlib.sha256(PASSWORD.encode()).hexdigest()}".encode(server.FORMAT))
+    resp = s.recv(server.SIZE).decode(server.FORMAT)
+    if not resp.startswith("OK@"):
+        raise RuntimeError(f"Auth failed: {resp}")
+    return s
+
+# Uploads local_path as remote_name, returns (stored name, seconds)
+def upload(s: socket.socket, local_path: str, remote_name: str) -> tuple:
+    filesize = os.path.getsize(local_path)
+    s.sendall(f"UPLOAD {remote_name} {filesize}".encode(server.FORMAT))
+    resp = s.recv(server.SIZE).decode(server.FORMAT)
+    if resp == "OK@EXISTS":
+        s.sendall(b"y")
+        resp = s.recv(server.SIZE).decode(server.FORMAT)
+    if not resp.startswith("READY@"):
+        raise RuntimeError(f"Upload refused: {resp}")
+
+    start = time.time()
+    hasher = hashlib.sha256()
+    with open(local_path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK)
+            if not chunk:
+                break
+            s.sendall(chunk)
+            hasher.update(chunk)
+    s.sendall(f"SHA256@{hasher.hexdigest()}".encode(server.FORMAT))
+    final = s.recv(server.SIZE).decode(server.FORMAT)
+    elapsed = time.time() - start
+    if not final.startswith("OK@"):
+        raise RuntimeError(f"Upload failed: {final}")
+    return final.split(": ", 1)[1], elapsed
+
+# Downloads remote_name and throws the bytes away, returns seconds
+def download(s: socket.socket, remote_name: str) -> float:
+    s.sendall(f"DOWNLOAD {remote_name}".encode(server.FORMAT))
+    resp = s.recv(server.SIZE).decode(server.FORMAT)
+    if not resp.startswith("FILEINFO@"):
+        raise RuntimeError(f"Download refused: {resp}")
+    remaining = int(resp.split("@")[1])
+
+    start = time.time()
+    s.sendall(b"READY")
+    while remaining > 0:
+        chunk = s.recv(min(CHUNK, remaining))
+        if not chunk:
+            raise ConnectionError("Server closed connection mid-download")
+        remaining -= len(chunk)
+    s.recv(server.SIZE) # SHA256@<hex> trailer
+    return time.time() - start
+
+# Cold sequential read of a stored file, page cache dropped first
+def cold_read(path: str) -> float:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        start = time.time()
+        while os.read(fd, CHUNK):
+            pass
+        return time.time() - start
+    finally:
+        os.close(fd)
+
+def make_payload(size: int) -> str:
+    path = os.path.join(WORK_DIR, f"payload_{size}.bin")
+    with open(path, "wb") as f:
+        left = size
+        while left > 0:
+            n = min(CHUNK, left)
+            f.write(os.urandom(n))
+            left -= n
+    return path
+
+def mbps(size: int, seconds: float) -> float:
+    return (size / 2**20) / seconds if seconds > 0 else 0.0
+
+
+# BENCHMARKS ------------------------------------------>
+
+# Baseline = how handle_upload used to write (4 KB writes, no fallocate, no hints)
+UPLOAD_CONFIGS = {
+    "baseline": {"PREALLOCATE": False, "WRITE_BUFFER_SIZE": 4096, "FADVISE": False},
+    "coalesce": {"PREALLOCATE": False, "WRITE_BUFFER_SIZE": 1 * 2**20, "FADVISE": False},
+    "prealloc+coalesce": {"PREALLOCATE": True, "WRITE_BUFFER_SIZE": 1 * 2**20, "FADVISE": False},
+    "prealloc+coalesce+fadvise": {"PREALLOCATE": True, "WRITE_BUFFER_SIZE": 1 * 2**20, "FADVISE": True},
+}
+
+def bench_upload(size_mb: int, count: int):
+    addr = start_local_server()
+    size = size_mb * 2**20
+    payload = make_payload(size)
+    server.FADVISE_MIN_BYTES = min(server.FADVISE_MIN_BYTES, size)
+
+    print(f"{'config':<28}{'upload MB/s':>14}{'download MB/s':>16}{'cold read MB/s':>17}")
+    for name, config in UPLOAD_CONFIGS.items():
+        for key, value in config.items():
+            setattr(server, key, value)
+
+        up_times, down_times, read_times = [], [], []
+        s = connect(addr)
+        try:
+            for i in range(count):
+                stored, seconds = upload(s, payload, f"bench_{name}_{i}.bin")
+                up_times.append(seconds)
+                read_times.append(cold_read(server.resolve_file(stored)))
+                down_times.append(download(s, stored))
+                s.sendall(f"DELETE {stored}".encode(server.FORMAT))
+                s.recv(server.SIZE)
+        finally:
+            s.close()
+
+        print(f"{name:<28}{mbps(size * count, sum(up_times)):>14.1f}"
+              f"{mbps(size * count, sum(down_times)):>16.1f}{mbps(size * count, sum(read_times)):>17.1f}")
+
+
+# Userspace stand-in for netem: relays connections to the server, holding each chunk for rtt/2
+# per direction and pacing it to the link rate. Per-message costs (round trips, Nagle stalls)
+# and the bandwidth cap are real; the kernel's TCP window limits are not, because the relay's
+# own loopback legs ack instantly (use --link netem for those).
+class LinkRelay:
+    def __init__(self, target, rtt: float, rate: float):
+        self.target = target
+        self.delay = rtt / 2
+        self.rate = rate # bytes/sec
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(64)
+        self.addr = self.sock.getsockname()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            down, _ = self.sock.accept()
+            up = socket.create_connection(self.target)
+            for s in (down, up):
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._pipe(down, up)
+            self._pipe(up, down)
+
+    def _pipe(self, src, dst):
+        # (deliver_at, bytes), bounded so a fast sender eventually feels backpressure
+        q = queue.Queue(maxsize=256)
+
+        def reader():
+            link_free = 0.0
+            while True:
+                try:
+                    data = src.recv(64 * 1024)
+                except OSError:
+                    data = b""
+                if not data:
+                    q.put((0.0, None))
+                    return
+                # Serialize onto the link, then propagate
+                link_free = max(time.monotonic(), link_free) + len(data) / self.rate
+                q.put((link_free + self.delay, data))
+
+        def writer():
+            while True:
+                deliver_at, data = q.get()
+                if data is None:
+                    try:
+                        dst.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    return
+                wait = deliver_at - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    dst.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=reader, daemon=True).start()
+        threading.Thread(target=writer, daemon=True).start()
+
+# Kernel emulation on loopback (needs root and sch_netem). Both directions cross lo, so each gets rtt/2.
+def netem(rtt_ms: float, rate_mbit: float, enable: bool):
+    if enable:
+        subprocess.run(["tc", "qdisc", "add", "dev", "lo", "root", "netem",
+                        "delay", f"{rtt_ms / 2}ms", "rate", f"{rate_mbit}mbit"], check=True)
+    else:
+        subprocess.run(["tc", "qdisc", "del", "dev", "lo", "root"], check=False)
+
+# Baseline = plain sockets, no tuning at all
+SOCKET_BENCH_PROFILES = ["baseline", "lan", "wan", "high_bdp", "auto"]
+
+def bench_sockets(rtt_ms: float, rate_mbit: float, size_mb: int, requests: int, link: str):
+    server_addr = start_local_server()
+    server.SOCKET_PROFILES["baseline"] = {"nodelay": False, "keepalive": None, "sndbuf": None, "rcvbuf": None}
+    rate = rate_mbit * 10**6 / 8
+
+    if link == "netem":
+        netem(rtt_ms, rate_mbit, True)
+        addr = server_addr
+    else:
+        addr = LinkRelay(server_addr, rtt_ms / 1000, rate).addr
+        print(f"(userspace relay: {rtt_ms} ms RTT, {rate_mbit} Mbit/s, TCP window effects need --link netem)")
+
+    size = size_mb * 2**20
+    big = make_payload(size)
+    small = make_payload(4096)
+
+    print(f"{'profile':<12}{'DIR ms':>10}{'4K upload ms':>14}{'upload MB/s':>14}{'download MB/s':>16}{'sndbuf KB':>12}")
+    try:
+        for name in SOCKET_BENCH_PROFILES:
+            server.SOCKET_PROFILE = name
+            s = connect(addr, tune=True)
+            try:
+                start = time.time()
+                for _ in range(requests):
+                    s.sendall(b"DIR")
+                    s.recv(server.SIZE)
+                dir_ms = (time.time() - start) / requests * 1000
+
+                start = time.time()
+                stored = []
+                for i in range(requests):
+                    stored.append(upload(s, small, f"small_{name}_{i}.bin")[0])
+                small_ms = (time.time() - start) / requests * 1000
+
+                big_name, up_seconds = upload(s, big, f"big_{name}.bin")
+                down_seconds = download(s, big_name)
+                sndbuf = s.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+
+                for n in stored + [big_name]:
+                    s.sendall(f"DELETE {n}".encode(server.FORMAT))
+                    s.recv(server.SIZE)
+            finally:
+                s.close()
+
+            print(f"{name:<12}{dir_ms:>10.1f}{small_ms:>14.1f}{mbps(size, up_seconds):>14.1f}"
+                  f"{mbps(size, down_seconds):>16.1f}{sndbuf / 1024:>12.0f}")
+    finally:
+        if link == "netem":
+            netem(rtt_ms, rate_mbit, False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="File server benchmarks (localhost)")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p_upload = sub.add_parser("upload", help="preallocation / write coalescing / fadvise")
+    p_upload.add_argument("--size-mb", type=int, default=256)
+    p_upload.add_argument("--count", type=int, default=3)
+
+    p_sockets = sub.add_parser("sockets", help="socket profiles over an emulated link")
+    p_sockets.add_argument("--rtt-ms", type=float, default=40)
+    p_sockets.add_argument("--rate-mbit", type=float, default=200)
+    p_sockets.add_argument("--size-mb", type=int, default=32)
+    p_sockets.add_argument("--requests", type=int, default=50)
+    p_sockets.add_argument("--link", choices=["relay", "netem"], default="relay")
+
+    args = parser.parse_args()
+    if args.bench == "upload":
+        bench_upload(args.size_mb, args.count)
+    elif args.bench == "sockets":
+        bench_sockets(args.rtt_ms, args.rate_mbit, args.size_mb, args.requests, args.link)
@@ -2,7 +2,10 @@
 import os
 import socket
 import hashlib
+import struct
+import tarfile
 import threading
+import time
 from tkinter import Tk, Button, Label, Listbox, Scrollbar, END, SINGLE, filedialog, messagebox, simpledialog
 
 IP = "129.213.84.251"
@@ -12,11 +15,128 @@ ADDR = (IP, PORT)
 SIZE = 4096
 FORMAT = "utf-8"
 
+# Socket tuning, same profiles as the server (see SOCKET_PROFILES in server.py).
+# "auto" sizes buffers to 2x RTT x throughput, using the rate of our last big transfer.
+SOCKET_PROFILE = "lan"
+SOCKET_PROFILES = {
+    "lan": {"nodelay": True, "keepalive": (60, 10, 5), "sndbuf": None, "rcvbuf": None},
+    "wan": {"nodelay": True, "keepalive": (30, 10, 6), "sndbuf": 4 * 2**20, "rcvbuf": 4 * 2**20},
+    "high_bdp": {"nodelay": True, "keepalive": (30, 10, 6), "sndbuf": 32 * 2**20, "rcvbuf": 32 * 2**20},
+}
+AUTO_BUFFER_MIN = 256 * 1024
+AUTO_BUFFER_MAX = 64 * 2**20
+AUTO_DEFAULT_RATE = 100 * 2**20 // 8 # bytes/sec until we've measured a transfer
+RATE_MIN_BYTES = 2**20 # smaller transfers don't say much about the link
+
+# Change feed (SUBSCRIBE on an extra socket). The server sends a HEARTBEAT at least every 15s,
+# so a silent feed for FEED_TIMEOUT means it's gone and we resubscribe from the last seq.
+FEED_TIMEOUT = 45
+FEED_RETRY = 3 # seconds between resubscribe attempts
+
+# Session tokens expire (server's SESSION_TTL). Every RESUME returns a fresh one, so halfway
+# through a token's life we open a throwaway connection just to swap it.
+RENEW_RETRY = 30 # seconds before trying again if a renewal failed
+
 
 def sha256_hex(s: str) -> str:
     return hashlib.sha256(s.encode(FORMAT)).hexdigest()
 
 
+def _set_buffers(sock: socket.socket, sndbuf, rcvbuf):
+    try:
+        if sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        if rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    except OSError:
+        pass
+
+# Smoothed RTT in seconds (Linux TCP_INFO), None elsewhere
+def _tcp_rtt(sock: socket.socket):
+    if not hasattr(socket, "TCP_INFO"):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        rtt_us = struct.unpack_from("8B16I", info)[8 + 15]
+    except (OSError, struct.error):
+        return None
+    return rtt_us / 1e6 if rtt_us else None
+
+# Connected, tuned socket to the server. rate = last measured throughput in bytes/sec, for "auto".
+def open_socket(rate=None) -> socket.socket:
+    profile = SOCKET_PROFILES.get(SOCKET_PROFILE, SOCKET_PROFILES["wan"])
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        # Receive buffer has to be set before connect to count for the window scale
+        if SOCKET_PROFILE != "auto":
+            _set_buffers(s, profile["sndbuf"], profile["rcvbuf"])
+        s.connect(ADDR)
+
+        if profile["nodelay"]:
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if profile["keepalive"]:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                idle, interval, count = profile["keepalive"]
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+
+        if SOCKET_PROFILE == "auto":
+            rtt = _tcp_rtt(s) or 0.0
+            size = int(min(AUTO_BUFFER_MAX, max(AUTO_BUFFER_MIN, 2 * (rate or AUTO_DEFAULT_RATE) * rtt)))
+            _set_buffers(s, size, size)
+    except Exception:
+        s.close()
+        raise
+    return s
+
+
+# RESUME refused (DISCONNECTED@...): the token is expired or from before a server restart,
+# retrying with it is pointless
+class SessionError(ConnectionError):
+    pass
+
+
+# File-like reader over the server's ARCHIVE frames (<4-byte length><bytes>, 0 = end),
+# so tarfile can extract while the stream is still arriving.
+class ChunkedSocketReader:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.frame_left = 0
+        self.done = False
+
+    def _recv_exact(self, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("Server closed connection mid-archive")
+            buf += chunk
+        return bytes(buf)
+
+    def read(self, n: int = -1) -> bytes:
+        out = bytearray()
+        while not self.done and (n < 0 or len(out) < n):
+            if self.frame_left == 0:
+                (self.frame_left,) = struct.unpack("!I", self._recv_exact(4))
+                if self.frame_left == 0:
+                    self.done = True
+                    break
+            want = self.frame_left if n < 0 else min(self.frame_left, n - len(out), SIZE * 16)
+            chunk = self.sock.recv(want)
+            if not chunk:
+                raise ConnectionError("Server closed connection mid-archive")
+            out += chunk
+            self.frame_left -= len(chunk)
+        return bytes(out)
+
+    # tarfile may stop before the end-of-stream frame (record padding), eat the rest
+    def drain(self):
+        while not self.done:
+            self.read(SIZE * 16)
+
+
 class FileClientGUI:
     def __init__(self, root: Tk):
         self.root = root
@@ -24,7 +144,20 @@ class FileClientGUI:
         self.root.geometry("520x320")
 
         self.client: socket.socket | None = None
+        # One command (and its transfer) at a time on self.client, held by each task for its whole
+        # exchange so a DIR from the feed can't land in the middle of an UPLOAD/DOWNLOAD
+        self.control_lock = threading.Lock()
         self.username: str | None = None
+        self.session_token: str | None = None # from CONNECT, lets extra sockets skip the password
+        self.session_renew_at = 0.0 # time.time() after which the token should be swapped
+        self.session_generation = 0 # bumped per login, so an old renewal chain stops
+        self.measured_rate: float | None = None # bytes/sec of the last big transfer, for SOCKET_PROFILE "auto"
+
+        # Change feed: while subscribed, the list is kept current by server pushes instead of DIR
+        self.subscribed = False
+        self.feed_seq: int | None = None
+        self.feed_sock: socket.socket | None = None
+        self.feed_stop = threading.Event()
 
         self.status = Label(root, text="Not connected")
         self.status.pack(pady=6)
@@ -47,6 +180,7 @@ class FileClientGUI:
         Button(btnrow, text="Delete", width=12, command=self.delete_file).pack(side="left", padx=6, pady=8)
 
         Button(root, text="Subfolder (create/delete)", command=self.subfolder).pack(pady=4)
+        Button(root, text="Download Folder", command=self.download_folder).pack(pady=4)
         Button(root, text="Logout/Quit", command=self.logout).pack(pady=4)
 
     # ---------- low-level helpers ----------
@@ -62,6 +196,178 @@ class FileClientGUI:
     def _send_text(self, msg: str):
         self.client.sendall(msg.encode(FORMAT))
 
+    # Sends a command and returns the first reply. The server reaps sockets that sit idle for
+    # IDLE_TIMEOUT, so if the control connection turns out to be gone we reopen it with RESUME
+    # and send again (the server closed it before reading the command, nothing ran twice).
+    # Caller holds control_lock, _reconnect swaps self.client.
+    def _request(self, msg: str) -> str:
+        try:
+            self._send_text(msg)
+            return self._recv_text()
+        except OSError:
+            pass
+        self._reconnect()
+        self._send_text(msg)
+        return self._recv_text()
+
+    def _reconnect(self):
+        old, self.client = self.client, None
+        if old:
+            old.close()
+        try:
+            self.client = self._open_extra_connection()
+        except Exception:
+            # Token's no good anymore (or the server's gone), back to square one
+            self._stop_feed()
+            self.username = None
+            self.session_token = None
+            self.root.after(0, lambda: self._set_status("Not connected"))
+            raise ConnectionError("Connection to the server was lost, please connect again")
+
+    # Opens another authenticated socket using the session token (RESUME), so long jobs
+    # don't tie up the main connection. Caller closes it.
+    def _open_extra_connection(self) -> socket.socket:
+        if not self.session_token:
+            raise ConnectionError("No session token, reconnect first")
+        s = open_socket(self.measured_rate)
+        try:
+            s.sendall(f"RESUME {self.session_token}".encode(FORMAT))
+            resp = s.recv(SIZE).decode(FORMAT).strip()
+            if resp.startswith("DISCONNECTED@"):
+                raise SessionError(resp)
+            if not resp.startswith("OK@"):
+                raise ConnectionError(resp)
+            # OK@Resumed@<token>@<ttl_seconds>
+            fields = resp.split("@")
+            if len(fields) > 3:
+                self._store_token(fields[2], int(fields[3]))
+        except Exception:
+            s.close()
+            raise
+        return s
+
+    def _store_token(self, token: str, ttl: int):
+        self.session_token = token
+        self.session_renew_at = time.time() + ttl / 2
+
+    # One chain per login: waits until the token is due, swaps it with a RESUME (any other
+    # RESUME in between pushes the due time back), and schedules itself again
+    def _renew_session(self, generation: int):
+        if generation != self.session_generation or not self.session_token:
+            return
+        due = self.session_renew_at - time.time()
+        if due > 0:
+            self.root.after(int(due * 1000) + 1, lambda: self._renew_session(generation))
+            return
+
+        def task():
+            retry = 0
+            try:
+                sock = self._open_extra_connection()
+                try:
+                    sock.sendall("LOGOUT".encode(FORMAT))
+                finally:
+                    sock.close()
+            except Exception:
+                # The current token is good until it expires, try again a bit later
+                retry = RENEW_RETRY * 1000
+            self.root.after(retry, lambda: self._renew_session(generation))
+
+        threading.Thread(target=task, daemon=True).start()
+
+    def _note_rate(self, nbytes: int, seconds: float):
+        if nbytes >= RATE_MIN_BYTES and seconds > 0:
+            self.measured_rate = nbytes / seconds
+
+    # With a live subscription the server pushes the change to us, otherwise re-list
+    def _refresh_after_change(self):
+        if not self.subscribed:
+            self.dir_refresh()
+
+    def _start_feed(self):
+        self.feed_stop.clear()
+        self.feed_seq = None
+        threading.Thread(target=self._feed_loop, daemon=True).start()
+
+    def _stop_feed(self):
+        self.feed_stop.set()
+        self.subscribed = False
+        if self.feed_sock:
+            try:
+                self.feed_sock.close()
+            except OSError:
+                pass
+            self.feed_sock = None
+
+    def _feed_loop(self):
+        first_attempt = True
+        while not self.feed_stop.is_set():
+            try:
+                sock = self._open_extra_connection()
+                self.feed_sock = sock
+                sock.settimeout(FEED_TIMEOUT)
+                since = f" {self.feed_seq}" if self.feed_seq is not None else ""
+                sock.sendall(f"SUBSCRIBE{since}".encode(FORMAT))
+
+                buf = b""
+                while not self.feed_stop.is_set():
+                    data = sock.recv(SIZE * 16)
+                    if not data:
+                        raise ConnectionError("Feed closed")
+                    buf += data
+                    if buf.startswith(b"ERROR@"):
+                        # Server can't do notifications (e.g. prefork), stick to DIR
+                        self.subscribed = False
+                        sock.close()
+                        self.root.after(0, self.dir_refresh)
+                        return
+                    *lines, buf = buf.split(b"\n")
+                    for line in lines:
+                        self._apply_feed_line(line.decode(FORMAT))
+            except SessionError:
+                # Token's no good, every retry would just be refused too. Stick to DIR.
+                self.subscribed = False
+                if not self.feed_stop.is_set():
+                    self.root.after(0, self.dir_refresh)
+                return
+            except Exception:
+                # Lost it (or never got it), fall back to DIR until we're resubscribed
+                was_subscribed, self.subscribed = self.subscribed, False
+                if (was_subscribed or first_attempt) and not self.feed_stop.is_set():
+                    self.root.after(0, self.dir_refresh)
+            finally:
+                if self.feed_sock:
+                    self.feed_sock.close()
+                    self.feed_sock = None
+            first_attempt = False
+            self.feed_stop.wait(FEED_RETRY)
+
+    # SNAPSHOT@<seq>@<listing> | EVENT@<seq>@<added|removed>@<size>@<path> | HEARTBEAT@<seq>
+    def _apply_feed_line(self, line: str):
+        kind, seq, rest = (line.split("@", 2) + [""])[:3]
+        if kind == "SNAPSHOT":
+            entries = [] if rest == "<empty>" else rest.split(",")
+            self.root.after(0, lambda: self._show_entries(entries))
+        elif kind == "EVENT":
+            change, _size, path = rest.split("@", 2)
+            self.root.after(0, lambda: self._apply_change(change, path))
+        elif kind != "HEARTBEAT":
+            return
+        self.feed_seq = int(seq)
+        self.subscribed = True
+
+    def _show_entries(self, entries: list):
+        self.remote_list.delete(0, END)
+        for e in entries:
+            self.remote_list.insert(END, e)
+
+    def _apply_change(self, change: str, path: str):
+        items = self.remote_list.get(0, END)
+        if change == "added" and path not in items:
+            self.remote_list.insert(END, path)
+        elif change == "removed" and path in items:
+            self.remote_list.delete(items.index(path))
+
     def _require_conn(self) -> bool:
         if not self.client:
             messagebox.showerror("Error", "Not connected.")
@@ -84,8 +390,7 @@ class FileClientGUI:
         pw_hex = sha256_hex(password)
 
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect(ADDR)
+            s = open_socket(self.measured_rate)
             self.client = s
             self.username = username
 
@@ -93,13 +398,30 @@ class FileClientGUI:
             resp = self._recv_text()
 
             if resp.startswith("OK@"):
+                # OK@Authenticated@<token>@<ttl_seconds>
+                fields = resp.split("@")
+                if len(fields) > 3:
+                    self._store_token(fields[2], int(fields[3]))
+                    self.session_generation += 1
+                    self._renew_session(self.session_generation)
                 self._set_status(f"Connected as {username}")
-                self.dir_refresh()
+                # The feed's first message is a full listing (falls back to DIR if it can't subscribe)
+                self._start_feed()
+            elif resp.startswith("BUSY@"):
+                # BUSY@<retry_after_seconds>@<reason>
+                _, retry_after, reason = (resp.split("@", 2) + [""])[:3]
+                messagebox.showerror("Server busy", f"{reason}. Try again in {retry_after} seconds.")
+                self.client.close()
+                self.client = None
+                self.username = None
+                self.session_token = None
+                self._set_status("Not connected")
             else:
                 messagebox.showerror("Auth failed", resp)
                 self.client.close()
                 self.client = None
                 self.username = None
+                self.session_token = None
                 self._set_status("Not connected")
         except Exception as e:
             messagebox.showerror("Error", f"Connect failed: {e}")
@@ -109,6 +431,7 @@ class FileClientGUI:
             finally:
                 self.client = None
                 self.username = None
+                self.session_token = None
                 self._set_status("Not connected")
 
     def dir_refresh(self):
@@ -117,8 +440,8 @@ class FileClientGUI:
 
         def task():
             try:
-                self._send_text("DIR")
-                resp = self._recv_text()
+                with self.control_lock:
+                    resp = self._request("DIR")
                 if not resp.startswith("OK@"):
                     self.root.after(0, lambda: messagebox.showerror("DIR error", resp))
                     return
@@ -126,12 +449,7 @@ class FileClientGUI:
                 listing = resp.split("@", 1)[1]
                 entries = [] if listing == "<empty>" else listing.split(",")
 
-                def update_ui():
-                    self.remote_list.delete(0, END)
-                    for e in entries:
-                        self.remote_list.insert(END, e)
-
-                self.root.after(0, update_ui)
+                self.root.after(0, lambda: self._show_entries(entries))
             except Exception as e:
                 self.root.after(0, lambda: messagebox.showerror("Error", f"DIR failed: {e}"))
 
@@ -149,10 +467,10 @@ class FileClientGUI:
 
         def task():
             try:
-                self._send_text(f"SUBFOLDER {action.strip().lower()} {path.strip()}")
-                resp = self._recv_text()
+                with self.control_lock:
+                    resp = self._request(f"SUBFOLDER {action.strip().lower()} {path.strip()}")
                 self.root.after(0, lambda: messagebox.showinfo("Subfolder", resp))
-                self.dir_refresh()
+                self._refresh_after_change()
             except Exception as e:
                 self.root.after(0, lambda: messagebox.showerror("Error", f"Subfolder failed: {e}"))
 
@@ -172,11 +490,11 @@ class FileClientGUI:
 
         def task():
             try:
-                self._send_text(f"DELETE {name}")
-                resp = self._recv_text()
+                with self.control_lock:
+                    resp = self._request(f"DELETE {name}")
                 if resp.startswith("OK@"):
                     self.root.after(0, lambda: messagebox.showinfo("Delete", resp))
-                    self.dir_refresh()
+                    self._refresh_after_change()
                 else:
                     self.root.after(0, lambda: messagebox.showerror("Delete failed", resp))
             except Exception as e:
@@ -200,46 +518,52 @@ class FileClientGUI:
 
         def task():
             try:
-                self._send_text(f"UPLOAD {remote_path} {filesize}")
-
-                # server may reply OK@EXISTS, READY@..., or ERROR@...
-                while True:
-                    resp = self._recv_text()
-                    if resp == "OK@EXISTS":
-                        overwrite = messagebox.askyesno("Upload", "Remote file exists. Overwrite?")
-                        self._send_text("y" if overwrite else "n")
-                        if not overwrite:
-                            cancel_msg = self._recv_text()
-                            self.root.after(0, lambda: messagebox.showinfo("Upload", cancel_msg))
-                            return
-                        continue
+                with self.control_lock:
+                    resp = self._request(f"UPLOAD {remote_path} {filesize}")
+
+                    # server may reply OK@EXISTS, READY@..., or ERROR@...
+                    while True:
+                        if resp == "OK@EXISTS":
+                            overwrite = messagebox.askyesno("Upload", "Remote file exists. Overwrite?")
+                            self._send_text("y" if overwrite else "n")
+                            if not overwrite:
+                                cancel_msg = self._recv_text()
+                                self.root.after(0, lambda: messagebox.showinfo("Upload", cancel_msg))
+                                return
+                            resp = self._recv_text()
+                            continue
+
+                        if resp.startswith("READY@"):
+                            break
 
-                    if resp.startswith("READY@"):
-                        break
+                        if resp.startswith("ERROR@") or resp.startswith("DISCONNECTED@"):
+                            self.root.after(0, lambda: messagebox.showerror("Upload failed", resp))
+                            return
 
-                    if resp.startswith("ERROR@") or resp.startswith("DISCONNECTED@"):
-                        self.root.after(0, lambda: messagebox.showerror("Upload failed", resp))
+                        self.root.after(0, lambda: messagebox.showerror("Upload failed", f"Unexpected: {resp}"))
                         return
 
-                    self.root.after(0, lambda: messagebox.showerror("Upload failed", f"Unexpected: {resp}"))
-                    return
-
-                # send file bytes
-                with open(local_path, "rb") as f:
-                    remaining = filesize
-                    while remaining > 0:
-                        chunk = f.read(min(SIZE, remaining))
-                        if not chunk:
-                            break
-                        self.client.sendall(chunk)
-                        remaining -= len(chunk)
-
-                final = self._recv_text()
-                if final.startswith("OK@"):
-                    self.root.after(0, lambda: messagebox.showinfo("Upload", final))
-                    self.dir_refresh()
-                else:
-                    self.root.after(0, lambda: messagebox.showerror("Upload failed", final))
+                    # send file bytes, hashing as we go, then the digest so the server can verify
+                    hasher = hashlib.sha256()
+                    start = time.time()
+                    with open(local_path, "rb") as f:
+                        remaining = filesize
+                        while remaining > 0:
+                            chunk = f.read(min(SIZE, remaining))
+                            if not chunk:
+                                break
+                            self.client.sendall(chunk)
+                            hasher.update(chunk)
+                            remaining -= len(chunk)
+                    self._send_text(f"SHA256@{hasher.hexdigest()}")
+
+                    final = self._recv_text()
+                    if final.startswith("OK@"):
+                        self._note_rate(filesize, time.time() - start)
+                        self.root.after(0, lambda: messagebox.showinfo("Upload", final))
+                        self._refresh_after_change()
+                    else:
+                        self.root.after(0, lambda: messagebox.showerror("Upload failed", final))
 
             except Exception as e:
                 self.root.after(0, lambda: messagebox.showerror("Error", f"Upload failed: {e}"))
@@ -265,47 +589,125 @@ class FileClientGUI:
 
         def task():
             try:
-                self._send_text(f"DOWNLOAD {name}")
-                resp = self._recv_text()
+                with self.control_lock:
+                    resp = self._request(f"DOWNLOAD {name}")
+                    if resp.startswith("ERROR@"):
+                        self.root.after(0, lambda: messagebox.showerror("Download failed", resp))
+                        return
+                    if not resp.startswith("FILEINFO@"):
+                        self.root.after(0, lambda: messagebox.showerror("Download failed", f"Unexpected: {resp}"))
+                        return
+
+                    filesize = int(resp.split("@", 1)[1])
+                    self._send_text("READY")
+
+                    remaining = filesize
+                    hasher = hashlib.sha256()
+                    start = time.time()
+                    with open(save_path, "wb") as f:
+                        while remaining > 0:
+                            chunk = self.client.recv(min(SIZE, remaining))
+                            if not chunk:
+                                raise ConnectionError("Server closed connection mid-download")
+                            f.write(chunk)
+                            hasher.update(chunk)
+                            remaining -= len(chunk)
+
+                    # server follows the data with SHA256@<hex>
+                    trailer = self._recv_text()
+                    if trailer != f"SHA256@{hasher.hexdigest()}":
+                        os.remove(save_path)
+                        self.root.after(0, lambda: messagebox.showerror("Download failed", "Checksum mismatch, file discarded"))
+                        return
+
+                    self._note_rate(filesize, time.time() - start)
+                    self.root.after(0, lambda: messagebox.showinfo("Download", f"Saved {filesize} bytes to:\n{save_path}"))
+            except Exception as e:
+                self.root.after(0, lambda: messagebox.showerror("Error", f"Download failed: {e}"))
+
+        threading.Thread(target=task, daemon=True).start()
+
+    def download_folder(self):
+        if not self._require_conn():
+            return
+        sel = self.remote_list.curselection()
+        if not sel:
+            messagebox.showwarning("Download Folder", "Select a folder first.")
+            return
+
+        name = self.remote_list.get(sel[0])
+        if not name.endswith("/"):
+            messagebox.showwarning("Download Folder", "Select a folder (not a file).")
+            return
+
+        save_dir = filedialog.askdirectory(title="Extract into")
+        if not save_dir:
+            return
+        fmt = "tgz" if messagebox.askyesno("Download Folder", "Compress while transferring?") else "tar"
+
+        def task():
+            # Own connection, so browsing/other transfers keep working while the folder streams
+            sock = None
+            try:
+                sock = self._open_extra_connection()
+                sock.sendall(f"ARCHIVE {fmt} {name.rstrip('/')}".encode(FORMAT))
+                resp = sock.recv(SIZE).decode(FORMAT).strip()
                 if resp.startswith("ERROR@"):
                     self.root.after(0, lambda: messagebox.showerror("Download failed", resp))
                     return
-                if not resp.startswith("FILEINFO@"):
+                if not resp.startswith("ARCHIVE@"):
                     self.root.after(0, lambda: messagebox.showerror("Download failed", f"Unexpected: {resp}"))
                     return
 
-                filesize = int(resp.split("@", 1)[1])
-                self._send_text("READY")
-
-                remaining = filesize
-                with open(save_path, "wb") as f:
-                    while remaining > 0:
-                        chunk = self.client.recv(min(SIZE, remaining))
-                        if not chunk:
-                            raise ConnectionError("Server closed connection mid-download")
-                        f.write(chunk)
-                        remaining -= len(chunk)
-
-                self.root.after(0, lambda: messagebox.showinfo("Download", f"Saved {filesize} bytes to:\n{save_path}"))
+                sock.sendall("READY".encode(FORMAT))
+
+                reader = ChunkedSocketReader(sock)
+                with tarfile.open(fileobj=reader, mode="r|*") as tar:
+                    if hasattr(tarfile, "data_filter"):
+                        tar.extractall(save_dir, filter="data")
+                    else:
+                        for member in tar:
+                            parts = member.name.replace("\\", "/").split("/")
+                            if member.name.startswith(("/", "\\")) or ".." in parts:
+                                continue
+                            if member.isfile() or member.isdir():
+                                tar.extract(member, save_dir)
+                reader.drain()
+
+                final = sock.recv(SIZE).decode(FORMAT).strip()
+                sock.sendall("LOGOUT".encode(FORMAT))
+                if final.startswith("OK@"):
+                    self.root.after(0, lambda: messagebox.showinfo("Download Folder", f"{final}\nExtracted to:\n{save_dir}"))
+                else:
+                    self.root.after(0, lambda: messagebox.showerror("Download failed", final))
             except Exception as e:
                 self.root.after(0, lambda: messagebox.showerror("Error", f"Download failed: {e}"))
+            finally:
+                if sock:
+                    sock.close()
 
         threading.Thread(target=task, daemon=True).start()
 
     def logout(self):
+        self._stop_feed()
         if not self.client:
             self.root.destroy()
             return
-        try:
-            self._send_text("LOGOUT")
-            _ = self._recv_text()
-        except Exception:
-            pass
+        # Say goodbye only if nothing is mid-transfer on the socket, otherwise closing it is enough
+        if self.control_lock.acquire(blocking=False):
+            try:
+                self._send_text("LOGOUT")
+                _ = self._recv_text()
+            except Exception:
+                pass
+            finally:
+                self.control_lock.release()
         try:
             self.client.close()
         finally:
             self.client = None
             self.username = None
+            self.session_token = None
             self._set_status("Not connected")
             self.root.destroy()
 
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# Logging shared by the server and the analysis module.
+# Callers only put records on a queue, one background thread formats and writes them, so
+# handler threads never wait on stdout. Per-request messages (extra={"sampled": True}) can
+# be sampled and rate limited before they're even queued.
+import logging
+import logging.handlers
+import queue
+import json
+import sys
+import os
+import time
+import random
+import threading
+import atexit
+from datetime import datetime
+
+# CONFIG ------------------------------------------>
+
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "text" # "json" = one JSON object per line
+LOG_FILE = None # None = stdout
+LOG_QUEUE_SIZE = 10000 # records waiting for the writer thread, anything past that is dropped (and counted)
+
+# Only applies to per-request messages
+LOG_SAMPLE_RATE = 1.0 # fraction kept
+LOG_RATE_LIMIT = 200 # max per second, 0 = unlimited
+
+ROOT_LOGGER = "fileserver"
+
+# Attributes every LogRecord has, anything else came in through extra= and goes into the JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+# FORMATTERS ------------------------------------------>
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != "sampled":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{line} (+{suppressed} suppressed)" if suppressed else line
+
+
+# FILTERS / HANDLERS ------------------------------------------>
+
+# Sampling + token bucket for records marked sampled. Whatever gets cut is counted and
+# reported on the next record that makes it through.
+class RequestFilter(logging.Filter):
+    def __init__(self, sample_rate: float, rate_limit: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self.tokens = float(rate_limit)
+        self.last = time.monotonic()
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False) or record.levelno >= logging.WARNING:
+            return True
+        with self.lock:
+            keep = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+            if keep and self.rate_limit > 0:
+                now = time.monotonic()
+                self.tokens = min(float(self.rate_limit), self.tokens + (now - self.last) * self.rate_limit)
+                self.last = now
+                keep = self.tokens >= 1
+                if keep:
+                    self.tokens -= 1
+            if not keep:
+                self.suppressed += 1
+                return False
+            if self.suppressed:
+                record.suppressed, self.suppressed = self.suppressed, 0
+        return True
+
+# QueueHandler that leaves formatting to the writer thread and never blocks on a full queue
+class _QueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+# Stopping has to get its sentinel in even when the queue is full
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+# SETUP ------------------------------------------>
+
+_handler = None
+_listener = None
+_setup_lock = threading.Lock()
+
+def _output_handler() -> logging.Handler:
+    out = logging.FileHandler(LOG_FILE) if LOG_FILE else logging.StreamHandler(sys.stdout)
+    out.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    return out
+
+def setup_logging(level: str=None, fmt: str=None, path: str=None):
+    """
+    Purpose: (Re)configure logging. Optional, get_logger sets up the CONFIG defaults on first use
+
+    Parameters:
+        level: e.g. "DEBUG", "INFO", "WARNING"
+        fmt: "text" or "json"
+        path: Log file, None = stdout
+    """
+    global LOG_LEVEL, LOG_FORMAT, LOG_FILE, _handler, _listener
+    with _setup_lock:
+        LOG_LEVEL = level or LOG_LEVEL
+        LOG_FORMAT = fmt or LOG_FORMAT
+        LOG_FILE = path if path is not None else LOG_FILE
+
+        root = logging.getLogger(ROOT_LOGGER)
+        if _listener is not None:
+            _listener.stop()
+            root.removeHandler(_handler)
+
+        q = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _handler = _QueueHandler(q)
+        _handler.addFilter(RequestFilter(LOG_SAMPLE_RATE, LOG_RATE_LIMIT))
+        root.addHandler(_handler)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+
+        _listener = _QueueListener(q, _output_handler())
+        _listener.start()
+
+def get_logger(name: str) -> logging.Logger:
+    if _listener is None:
+        setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+# Writes out whatever is still queued. Call before os._exit, atexit handles normal exits.
+def shutdown():
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+            if _handler.dropped:
+                sys.stderr.write(f"[logutil] {_handler.dropped} log records dropped (queue full)\n")
+
+# A forked child has the queue but not the writer thread, give it its own
+def _after_fork_in_child():
+    global _listener
+    if _listener is None:
+        return
+    _handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _listener = _QueueListener(_handler.queue, _output_handler())
+    _listener.start()
+
+atexit.register(shutdown)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
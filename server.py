@@ -3,9 +3,21 @@ import os
 import socket
 import threading
 import hashlib
+import hmac
 import time
+import struct
+import tarfile
+import stat
+import queue
+import fcntl
+import argparse
+import tempfile
+import shutil
+import selectors
+from collections import OrderedDict, deque
 
 from analysis import NetworkAnalysisModule  # Aidan's module
+import logutil
 
 import re
 # CONFIG ------------------------------------------>
@@ -17,6 +29,89 @@ ADDR = (HOST, PORT)
 SIZE = 4096 # buffer size
 FORMAT = "utf-8"
 DATA_DIR = "server_data" # Will be made if not present
+LOCK_DIR = ".server_locks" # holds the lock file for file_locks, kept outside DATA_DIR so DIR never shows it
+
+# Prefork mode: >1 starts that many processes sharing PORT via SO_REUSEPORT.
+# Rate limits, caches and admission limits below apply per worker process.
+WORKER_PROCESSES = 1
+
+# ARCHIVE streams a folder as a tar stream split into length-prefixed frames
+ARCHIVE_MODES = {"tar": "w|", "tgz": "w|gz"}
+ARCHIVE_FRAME_SIZE = 64 * 1024
+
+# In-memory cache for hot small files, DOWNLOAD serves hits straight from RAM
+CACHE_MAX_BYTES = 64 * 2**20 # total budget, 0 turns the cache off
+CACHE_MAX_FILE_BYTES = 1 * 2**20 # anything bigger is always streamed from disk
+
+# Resolved paths, stat results and open read-only fds for hot files (DOWNLOAD/DELETE lookups)
+STAT_CACHE_ENTRIES = 4096 # 0 turns it off
+FD_POOL_SIZE = 256 # max fds kept open, only files nobody is reading get closed to make room
+STAT_CACHE_TTL = 1.0 # seconds an entry is trusted before it's re-checked against the disk
+
+# Uploads are written to a hidden temp file and renamed into place when complete.
+# DURABILITY picks what happens before the rename:
+#   "none"  - no fsync, fastest, a crash can lose recent uploads
+#   "fsync" - fsync the file (and its folder after the rename) for every upload
+#   "group" - like fsync, but uploads finishing together are synced as one batch
+DURABILITY = "fsync"
+GROUP_COMMIT_WINDOW = 0.005 # seconds the group committer waits for more uploads to join a batch
+TEMP_PREFIX = ".upload-"
+RESERVE_PREFIX = ".reserve-" # hidden placeholder holding an auto-assigned name until its upload commits
+
+# Disk layout for uploads (UPLOAD sends the exact size up front, so we can plan the writes)
+PREALLOCATE = True # posix_fallocate the whole file before writing, less fragmentation
+WRITE_BUFFER_SIZE = 1 * 2**20 # small network reads are gathered into writes this big
+FADVISE = True # sequential/dontneed page cache hints for big transfers
+FADVISE_MIN_BYTES = 64 * 2**20 # smaller files are left to the kernel's defaults
+
+# Where stored files physically live. Clients always see (and send) the same flat paths.
+#   "flat"    - directly in their folder
+#   "sharded" - under <folder>/.shards/xx/yy/<name>, xx/yy from a hash of the name, so huge
+#               folders don't turn into one huge directory. Convert DATA_DIR with --migrate.
+STORAGE_LAYOUT = "flat"
+SHARD_DIR = ".shards" # reserved, clients can't use it in paths
+SHARD_LEVELS = 2 # 256 subfolders per level
+
+# Integrity: sha256 is computed while bytes stream and exchanged as SHA256@<hex> after
+# the file data. The server keeps each file's digest in a hidden .<name>.sha256 next to it.
+DIGEST_SUFFIX = ".sha256"
+HASH_OFFLOAD_MIN_BYTES = 8 * 2**20 # transfers this big are hashed on a helper thread
+
+# Bandwidth scheduling, in bytes/sec (0 = unlimited). Admins can change these live with RATELIMIT.
+GLOBAL_RATE_LIMIT = 0
+PER_CLIENT_RATE_LIMIT = 0
+SMALL_TRANSFER_BYTES = 256 * 1024 # transfers this small are never throttled
+ADMIN_USERS = set() # usernames allowed to run RATELIMIT
+
+# Admission control
+LISTEN_BACKLOG = 128 # kernel accept backlog
+MAX_WORKERS = 64 # client handler threads
+MAX_QUEUED = 128 # accepted connections allowed to wait for a free worker
+MAX_CONN_PER_IP = 16
+IDLE_TIMEOUT = 300 # seconds a socket may sit silent before it's reaped, None = never
+RETRY_AFTER = 5 # seconds, told to clients we turn away
+
+# Socket tuning. SOCKET_PROFILE is one of SOCKET_PROFILES, or "auto": wan settings, but each
+# connection's buffers are sized to its bandwidth-delay product (RTT from TCP_INFO, throughput
+# from what the analyzer measured on recent transfers).
+# keepalive = (idle seconds, probe interval, probes), buffers None = kernel autotuning
+# (setting a size turns autotuning off for that socket, so only do it when it's too small).
+SOCKET_PROFILE = "lan"
+SOCKET_PROFILES = {
+    "lan": {"nodelay": True, "keepalive": (60, 10, 5), "sndbuf": None, "rcvbuf": None},
+    "wan": {"nodelay": True, "keepalive": (30, 10, 6), "sndbuf": 4 * 2**20, "rcvbuf": 4 * 2**20},
+    "high_bdp": {"nodelay": True, "keepalive": (30, 10, 6), "sndbuf": 32 * 2**20, "rcvbuf": 32 * 2**20},
+}
+AUTO_BUFFER_MIN = 256 * 1024
+AUTO_BUFFER_MAX = 64 * 2**20 # the kernel also caps it at net.core.wmem_max/rmem_max
+AUTO_DEFAULT_RATE = 100 * 2**20 // 8 # bytes/sec assumed until a transfer has been measured
+
+# Change notifications (SUBSCRIBE). The last CHANGE_HISTORY events are kept so a client that
+# reconnects can catch up from its last sequence number, anyone further behind gets a snapshot.
+CHANGE_HISTORY = 1024
+MAX_SUBSCRIBERS = 256
+HEARTBEAT_INTERVAL = 15 # seconds between HEARTBEATs on a quiet subscription
+SUBSCRIBER_SEND_TIMEOUT = 5 # seconds a subscriber may take none of its queued pushes before it's dropped
 
 # Hard-coded users: username -> sha256(password).hexdigest()
 # Example: password "num1EnronFan" -> use Python to compute once on CLIENT SIDE!!
@@ -26,12 +121,385 @@ USERS = {
     
 }
 
+# Session tokens: a successful CONNECT hands out a token that extra or reconnecting sockets
+# can present with RESUME instead of the password. Every RESUME answers with a fresh token,
+# so a client that keeps resuming before SESSION_TTL runs out never has to log in again.
+# Tokens are HMAC-signed (no server-side table), so any prefork worker can check them.
+# Restarting the server invalidates them all.
+SESSION_TTL = 15 * 60 # seconds
+SESSION_SECRET = os.urandom(32)
+
+log = logutil.get_logger("server")
+
 # For "file currently being processed" requirement, ie don't destroy user data
+# path -> offset of its byte-range lock, for paths held by this process (see acquire_file_lock)
 file_locks = {}
 file_locks_lock = threading.Lock()
 
 # Analysis module imported that works on all client threads at once
-analyzer = NetworkAnalysisModule(source="server", verbose=True)
+# Every run also appends to one indexed SQLite history for cross-run queries
+METRICS_DB = os.path.join("analysis_reports", "metrics.db")
+analyzer = NetworkAnalysisModule(source="server", verbose=True, db_path=METRICS_DB)
+
+
+# Byte-bounded LRU of small file contents (and their sha256), keyed by absolute path.
+# Entries remember (mtime, size) so edits made outside the server are noticed.
+class FileContentCache:
+    def __init__(self, max_bytes: int, max_file_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.entries = OrderedDict() # path -> (mtime_ns, size, data, digest)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def wants(self, size: int) -> bool:
+        return self.max_bytes > 0 and size <= min(self.max_file_bytes, self.max_bytes)
+
+    def get(self, path: str, st):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and (entry[0], entry[1]) != (st.st_mtime_ns, st.st_size):
+                # Changed behind our back
+                self._drop_unsafe(path)
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(path)
+
+        if entry is None:
+            analyzer.record_counter("content_cache", "misses")
+            return None
+        analyzer.record_counter("content_cache", "hits")
+        return entry[2], entry[3]
+
+    def put(self, path: str, st, data: bytes, digest: str):
+        if not self.wants(len(data)):
+            return
+        evicted = 0
+        with self.lock:
+            self._drop_unsafe(path)
+            self.entries[path] = (st.st_mtime_ns, st.st_size, data, digest)
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._drop_unsafe(oldest)
+                evicted += 1
+        if evicted:
+            analyzer.record_counter("content_cache", "evictions", evicted)
+
+    def invalidate(self, path: str):
+        with self.lock:
+            dropped = self._drop_unsafe(path)
+        if dropped:
+            analyzer.record_counter("content_cache", "invalidations")
+
+    def _drop_unsafe(self, path: str) -> bool:
+        entry = self.entries.pop(path, None)
+        if entry is None:
+            return False
+        self.total_bytes -= len(entry[2])
+        return True
+
+content_cache = FileContentCache(CACHE_MAX_BYTES, CACHE_MAX_FILE_BYTES)
+
+
+# One cached file: its stat result and, once someone opened it, a shared read-only fd.
+# fds are shared between downloads, so always read them with os.pread.
+class FileHandle:
+    def __init__(self, st, fd=None):
+        self.st = st
+        self.fd = fd
+        self.refs = 0
+        self.checked_at = time.monotonic()
+        self.dropped = False # invalidated while in use, fd is closed on the last release
+
+def _same_file(a, b) -> bool:
+    return (a.st_ino, a.st_dev, a.st_size, a.st_mtime_ns) == (b.st_ino, b.st_dev, b.st_size, b.st_mtime_ns)
+
+# LRU of client path -> physical path and physical path -> FileHandle. The handlers that change
+# files invalidate entries, anything older than ttl is re-checked (inode/size/mtime) before
+# use so changes made outside the server are picked up too.
+class FileHandleCache:
+    def __init__(self, max_entries: int, max_fds: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_fds = max_fds
+        self.ttl = ttl
+        self.paths = OrderedDict() # client path -> physical path
+        self.entries = OrderedDict() # physical path -> FileHandle
+        self.open_fds = 0
+        self.lock = threading.Lock()
+
+    # resolve_file with memory, raises ValueError the same way
+    def resolve(self, rel_path: str) -> str:
+        if self.max_entries <= 0:
+            return resolve_file(rel_path)
+        with self.lock:
+            path = self.paths.get(rel_path)
+            if path is not None:
+                self.paths.move_to_end(rel_path)
+        if path is not None:
+            analyzer.record_counter("path_cache", "hits")
+            return path
+
+        analyzer.record_counter("path_cache", "misses")
+        path = resolve_file(rel_path)
+        with self.lock:
+            self.paths[rel_path] = path
+            if len(self.paths) > self.max_entries:
+                self.paths.popitem(last=False)
+        return path
+
+    # os.stat, None if missing
+    def stat(self, path: str):
+        entry = self._lookup(path)
+        if entry is not None:
+            analyzer.record_counter("stat_cache", "hits")
+            return entry.st
+
+        analyzer.record_counter("stat_cache", "misses")
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if stat.S_ISREG(st.st_mode) and self.max_entries > 0:
+            with self.lock:
+                if path not in self.entries:
+                    self.entries[path] = FileHandle(st)
+                    self._evict_unsafe()
+        return st
+
+    # Shared read-only handle of a regular file (or None), hand it back with release()
+    def open(self, path: str):
+        entry = self._lookup(path)
+        if entry is not None:
+            with self.lock:
+                if entry.fd is not None and not entry.dropped:
+                    entry.refs += 1
+                    analyzer.record_counter("fd_pool", "hits")
+                    return entry
+
+        analyzer.record_counter("fd_pool", "misses")
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            os.close(fd)
+            return None
+
+        entry = FileHandle(st, fd)
+        entry.refs = 1
+        with self.lock:
+            self.open_fds += 1
+            if self.max_entries > 0:
+                self._drop_unsafe(path)
+                self.entries[path] = entry
+            else:
+                entry.dropped = True
+            self._evict_unsafe()
+            open_fds = self.open_fds
+        analyzer.record_gauge("fd_pool", "open_fds", open_fds)
+        return entry
+
+    def release(self, entry: FileHandle):
+        with self.lock:
+            entry.refs -= 1
+            if entry.refs <= 0 and entry.dropped:
+                self._close_unsafe(entry)
+            self._evict_unsafe()
+
+    # Call after changing/removing a file
+    def invalidate(self, path: str):
+        with self.lock:
+            dropped = self._drop_unsafe(path)
+        if dropped:
+            analyzer.record_counter("stat_cache", "invalidations")
+
+    # Call after removing a folder, drops everything under it
+    def invalidate_tree(self, dir_abs: str):
+        prefix = dir_abs.rstrip(os.sep) + os.sep
+        with self.lock:
+            stale = [path for path in self.entries if path.startswith(prefix)]
+            for path in stale:
+                self._drop_unsafe(path)
+        if stale:
+            analyzer.record_counter("stat_cache", "invalidations", len(stale))
+
+    # Cached entry for path, re-checked against the disk first if it's older than ttl
+    def _lookup(self, path: str):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return None
+            self.entries.move_to_end(path)
+            if time.monotonic() - entry.checked_at < self.ttl:
+                return entry
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        with self.lock:
+            if st is not None and _same_file(st, entry.st) and not entry.dropped:
+                entry.checked_at = time.monotonic()
+                return entry
+            # Changed behind our back
+            if self.entries.get(path) is entry:
+                self._drop_unsafe(path)
+        analyzer.record_counter("stat_cache", "invalidations")
+        return None
+
+    def _drop_unsafe(self, path: str) -> bool:
+        entry = self.entries.pop(path, None)
+        if entry is None:
+            return False
+        entry.dropped = True
+        if entry.refs <= 0:
+            self._close_unsafe(entry)
+        return True
+
+    def _close_unsafe(self, entry: FileHandle):
+        if entry.fd is not None:
+            os.close(entry.fd)
+            entry.fd = None
+            self.open_fds -= 1
+
+    # Oldest idle fds go first, then the oldest entries altogether
+    # (Called with the lock held, the analyzer has its own)
+    def _evict_unsafe(self):
+        closed = 0
+        if self.open_fds > self.max_fds:
+            for entry in self.entries.values():
+                if self.open_fds <= self.max_fds:
+                    break
+                if entry.fd is not None and entry.refs <= 0:
+                    self._close_unsafe(entry)
+                    closed += 1
+        if closed:
+            analyzer.record_counter("fd_pool", "evictions", closed)
+
+        dropped = 0
+        while len(self.entries) > self.max_entries:
+            self._drop_unsafe(next(iter(self.entries)))
+            dropped += 1
+        if dropped:
+            analyzer.record_counter("stat_cache", "evictions", dropped)
+
+file_handles = FileHandleCache(STAT_CACHE_ENTRIES, FD_POOL_SIZE, STAT_CACHE_TTL)
+
+
+# Token bucket, rate in bytes/sec. Tokens may go negative, the caller sleeps off the debt.
+# Not thread safe on its own, TransferScheduler holds its lock around it.
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = 0.0
+        self.last = time.monotonic()
+
+    def reserve(self, nbytes: int) -> float:
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        burst = self.rate * 0.25 # allow a quarter second of burst
+        self.tokens = min(burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= nbytes
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+# One scheduled UPLOAD/DOWNLOAD/ARCHIVE. Small transfers aren't throttled so DIR-sized
+# work never waits behind a big VS* file.
+class Transfer:
+    def __init__(self, scheduler, user: str, weight: float, throttled: bool):
+        self.scheduler = scheduler
+        self.user = user
+        self.weight = weight
+        self.throttled = throttled
+        self.bucket = TokenBucket(0)
+        self.throttle_seconds = 0.0
+
+    # Call with the size of each chunk right before sending/after receiving it
+    def throttle(self, nbytes: int):
+        if not self.throttled:
+            return
+        wait = self.scheduler._reserve(self, nbytes)
+        if wait > 0:
+            time.sleep(wait)
+            self.throttle_seconds += wait
+
+    def finish(self):
+        if self.throttled:
+            self.scheduler._finish(self)
+
+
+# Global + per-client token buckets. The global rate is split between active users, then
+# between each user's transfers, by weight, and re-split whenever one starts or finishes.
+# Shares are fixed, not work-conserving: a user held back by their own client_rate (or a slow
+# link) leaves part of the global rate unused rather than handing it to the others.
+# "Client" means the logged-in user, so opening more sockets (RESUME, SUBSCRIBE) or running
+# more transfers doesn't buy a bigger share.
+class TransferScheduler:
+    def __init__(self, global_rate: float, client_rate: float):
+        self.global_rate = global_rate
+        self.client_rate = client_rate
+        self.active = set()
+        self.client_buckets = {} # username -> [TokenBucket, active transfer count]
+        self.lock = threading.Lock()
+
+    def start(self, user: str, size=None, weight: float=1.0) -> Transfer:
+        throttled = size is None or size >= SMALL_TRANSFER_BYTES
+        transfer = Transfer(self, user, weight, throttled)
+        if throttled:
+            with self.lock:
+                self.active.add(transfer)
+                entry = self.client_buckets.setdefault(user, [TokenBucket(self.client_rate), 0])
+                entry[1] += 1
+                self._rebalance_unsafe()
+        return transfer
+
+    def set_limits(self, global_rate=None, client_rate=None):
+        with self.lock:
+            if global_rate is not None:
+                self.global_rate = global_rate
+            if client_rate is not None:
+                self.client_rate = client_rate
+                for bucket, _ in self.client_buckets.values():
+                    bucket.rate = client_rate
+            self._rebalance_unsafe()
+
+    def _rebalance_unsafe(self):
+        # Users split the global rate first (a user weighs as much as their heaviest transfer),
+        # then each user's share is split between their own transfers
+        by_user = {}
+        for t in self.active:
+            by_user.setdefault(t.user, []).append(t)
+        user_weights = {user: max(t.weight for t in ts) for user, ts in by_user.items()}
+        total_weight = sum(user_weights.values())
+        for user, ts in by_user.items():
+            user_rate = self.global_rate * user_weights[user] / total_weight if self.global_rate > 0 else 0
+            user_total = sum(t.weight for t in ts)
+            for t in ts:
+                t.bucket.rate = user_rate * t.weight / user_total
+
+    def _reserve(self, transfer: Transfer, nbytes: int) -> float:
+        with self.lock:
+            wait = transfer.bucket.reserve(nbytes)
+            entry = self.client_buckets.get(transfer.user)
+            if entry is not None:
+                wait = max(wait, entry[0].reserve(nbytes))
+        return wait
+
+    def _finish(self, transfer: Transfer):
+        with self.lock:
+            self.active.discard(transfer)
+            entry = self.client_buckets.get(transfer.user)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self.client_buckets[transfer.user]
+            self._rebalance_unsafe()
+
+scheduler = TransferScheduler(GLOBAL_RATE_LIMIT, PER_CLIENT_RATE_LIMIT)
 
 
 # auto-naming function, jank but works kinda
@@ -61,27 +529,84 @@ def _prefix_for_ext(ext: str) -> str:
 def _looks_like_server_name(filename: str) -> bool:
     return re.match(r"^(TS|AS|VS|FS)\d{3,}(\.[^./\\]+)?$", filename, re.IGNORECASE) is not None
 
+# A freshly allocated name is held by a hidden placeholder next to where the file will go, so
+# nothing shows up in DIR until the upload commits and a crash leaves nothing visible behind
+# (_cleanup_temp_uploads clears leftover placeholders at startup).
+def _reservation_path(target: str) -> str:
+    return os.path.join(os.path.dirname(target), RESERVE_PREFIX + os.path.basename(target))
+
+# O_EXCL on the placeholder decides between uploads (threads or worker processes) racing for
+# the same name. False if someone else holds it or a file by that name already exists.
+def _try_reserve(target: str) -> bool:
+    try:
+        os.close(os.open(_reservation_path(target), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+    except FileExistsError:
+        return False
+    if os.path.exists(target):
+        os.remove(_reservation_path(target))
+        return False
+    return True
+
 def _allocate_server_filename(dir_abs: str, prefix: str, ext: str) -> str:
+    if STORAGE_LAYOUT == "sharded":
+        return _allocate_sharded_filename(dir_abs, prefix, ext)
+
     used = set()
     try:
         for name in os.listdir(dir_abs):
-            m = re.match(rf"^{re.escape(prefix)}(\d{{3,}})(\.[^./\\]+)?$", name, re.IGNORECASE)
+            m = re.match(rf"^(?:{re.escape(RESERVE_PREFIX)})?{re.escape(prefix)}(\d{{3,}})(\.[^./\\]+)?$",
+                         name, re.IGNORECASE)
             if m:
                 used.add(int(m.group(1)))
     except FileNotFoundError:
         pass
 
     n = 1
-    while n in used:
+    while True:
+        if n not in used:
+            width = max(3, len(str(n)))
+            name = f"{prefix}{n:0{width}d}{ext}"
+            if _try_reserve(os.path.join(dir_abs, name)):
+                return name
         n += 1
 
-    width = max(3, len(str(n)))
-    return f"{prefix}{n:0{width}d}{ext}"
+# Sharded folders are too big to rescan on every upload, so remember the next number per
+# (folder, prefix) after one scan. O_EXCL still has the last word: if another worker process
+# took the number, we just move on to the next one.
+# Each (folder, prefix) has its own lock, so a big folder's first scan only holds up uploads
+# into that folder.
+_name_hints = {} # (folder, prefix) -> next number to try
+_name_locks = {} # (folder, prefix) -> Lock
+_name_locks_lock = threading.Lock()
+
+def _allocate_sharded_filename(dir_abs: str, prefix: str, ext: str) -> str:
+    key = (dir_abs, prefix)
+    with _name_locks_lock:
+        key_lock = _name_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        n = _name_hints.get(key)
+        if n is None:
+            n = 1
+            for name, _ in _stored_files(dir_abs):
+                m = re.match(rf"^{re.escape(prefix)}(\d{{3,}})(\.[^./\\]+)?$", name, re.IGNORECASE)
+                if m:
+                    n = max(n, int(m.group(1)) + 1)
+
+        while True:
+            width = max(3, len(str(n)))
+            name = f"{prefix}{n:0{width}d}{ext}"
+            path = _shard_path(os.path.join(dir_abs, name))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if _try_reserve(path):
+                _name_hints[key] = n + 1
+                return name
+            n += 1
 
 # UTILS ------------------------------------------>
 
 def ensure_data_dir():
     os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(LOCK_DIR, exist_ok=True)
 
 # Don't let people traverse other files in the system, basically.
 # Returns absolute path under DATA_DIR or raises ValueError.
@@ -91,28 +616,663 @@ def safe_path(rel_path: str) -> str:
     base = os.path.abspath(DATA_DIR)
     if not abs_path.startswith(base):
         raise ValueError("Invalid path")
+    if SHARD_DIR in abs_path[len(base):].split(os.sep):
+        raise ValueError("Invalid path")
     return abs_path
 
+# Where a logical file path (as the client names it) is stored on disk
+def _shard_path(logical_abs: str, layout: str=None) -> str:
+    if (layout or STORAGE_LAYOUT) != "sharded":
+        return logical_abs
+    dir_abs, name = os.path.split(logical_abs)
+    h = hashlib.sha1(name.encode(FORMAT)).hexdigest()
+    return os.path.join(dir_abs, SHARD_DIR, *[h[2 * i:2 * i + 2] for i in range(SHARD_LEVELS)], name)
+
+# safe_path for files: absolute physical path of a client's file path, raises ValueError
+def resolve_file(rel_path: str) -> str:
+    return _shard_path(safe_path(rel_path))
+
+# (name, physical path) of every stored file in one logical folder
+def _stored_files(dir_abs: str, layout: str=None):
+    if (layout or STORAGE_LAYOUT) == "sharded":
+        for root, dirs, files in os.walk(os.path.join(dir_abs, SHARD_DIR)):
+            for name in files:
+                if not _is_hidden(name):
+                    yield name, os.path.join(root, name)
+        return
+    try:
+        with os.scandir(dir_abs) as it:
+            for entry in it:
+                if entry.is_file() and not _is_hidden(entry.name):
+                    yield entry.name, entry.path
+    except FileNotFoundError:
+        return
+
+# os.walk over the logical folders: shard trees are skipped as folders and their files are
+# reported as (name, physical path) under the folder they belong to
+def _walk_logical(top: str):
+    for root, dirs, files in os.walk(top):
+        if SHARD_DIR in dirs:
+            dirs.remove(SHARD_DIR)
+        if STORAGE_LAYOUT == "sharded":
+            stored = list(_stored_files(root))
+        else:
+            stored = [(name, os.path.join(root, name)) for name in files if not _is_hidden(name)]
+        yield root, dirs, stored
+
+# One lock file for every path: each path locks one byte (fcntl.lockf) at an offset taken
+# from its hash, so the lock also holds between worker processes without leaving a file per
+# path behind, and taking it is a single fcntl on an fd that stays open.
+# Record locks belong to the whole process, so file_locks keeps this process's threads apart,
+# and paths that hash to the same offset share that byte's lock.
+_lock_fd = None
+_lock_offsets = {} # offset -> how many of this process's file_locks sit on it
+
+def _lock_offset(path: str) -> int:
+    return int.from_bytes(hashlib.sha1(path.encode(FORMAT)).digest()[:8], "big") >> 2 # fits off_t
+
 # Locks file when it's being edited
 def acquire_file_lock(path: str) -> bool:
+    global _lock_fd
     with file_locks_lock:
-        if file_locks.get(path, 0) > 0:
+        if path in file_locks:
             return False
-        file_locks[path] = file_locks.get(path, 0) + 1
+        if _lock_fd is None:
+            _lock_fd = os.open(os.path.join(LOCK_DIR, "files.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        offset = _lock_offset(path)
+        if offset not in _lock_offsets:
+            try:
+                fcntl.lockf(_lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+            except (BlockingIOError, PermissionError):
+                # Another worker process has it
+                return False
+            _lock_offsets[offset] = 0
+        _lock_offsets[offset] += 1
+        file_locks[path] = offset
         return True
 
 # Unlocks file when done
 def release_file_lock(path: str):
     with file_locks_lock:
-        if path in file_locks:
-            file_locks[path] -= 1
-            if file_locks[path] <= 0:
-                del file_locks[path]
+        offset = file_locks.pop(path, None)
+        if offset is None:
+            return
+        _lock_offsets[offset] -= 1
+        if _lock_offsets[offset] == 0:
+            del _lock_offsets[offset]
+            fcntl.lockf(_lock_fd, fcntl.LOCK_UN, 1, offset)
+
+# Record locks aren't inherited by fork, so a child must not think it holds its parent's
+def _forget_file_locks():
+    file_locks.clear()
+    _lock_offsets.clear()
+
+os.register_at_fork(after_in_child=_forget_file_locks)
+
+# Names the server uses for its own bookkeeping (temp uploads, digests), never shown to clients.
+# Stored files always get TS/AS/VS/FS names, so a leading dot is ours.
+def _is_hidden(name: str) -> bool:
+    return name.startswith(".")
+
+def _digest_path(target: str) -> str:
+    dir_abs, name = os.path.split(target)
+    return os.path.join(dir_abs, f".{name}{DIGEST_SUFFIX}")
+
+# Stored sha256 of target, or None if missing or stale (file changed since it was written)
+def _load_digest(target: str, st):
+    try:
+        with open(_digest_path(target)) as f:
+            digest, size, mtime_ns = f.read().split()
+    except (OSError, ValueError):
+        return None
+    if int(size) != st.st_size or int(mtime_ns) != st.st_mtime_ns:
+        return None
+    return digest
+
+def _store_digest(target: str, digest: str):
+    try:
+        st = os.stat(target)
+        tmp_path = _digest_path(target) + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(f"{digest} {st.st_size} {st.st_mtime_ns}")
+        os.replace(tmp_path, _digest_path(target))
+    except OSError:
+        # Only an optimization, next download just rehashes
+        pass
+
+# Incremental sha256 of a transfer. Big transfers are hashed on a helper thread (hashlib
+# releases the GIL on large buffers) so the socket/disk loop never waits on it.
+class StreamHasher:
+    def __init__(self, size: int):
+        self.h = hashlib.sha256()
+        self.hash_seconds = 0.0 # time spent hashing, wherever it ran
+        self.wait_seconds = 0.0 # time the transfer itself waited on the hash
+        self.digest = None
+        self.queue = None
+        if size >= HASH_OFFLOAD_MIN_BYTES:
+            self.queue = queue.Queue(maxsize=8)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def update(self, data):
+        if self.queue is None:
+            t = time.perf_counter()
+            self.h.update(data)
+            spent = time.perf_counter() - t
+            self.hash_seconds += spent
+            self.wait_seconds += spent
+        else:
+            # Copy, callers reuse their buffers
+            self.queue.put(bytes(data))
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            t = time.perf_counter()
+            self.h.update(data)
+            self.hash_seconds += time.perf_counter() - t
+
+    # Safe to call more than once (and on failed transfers, to stop the helper thread)
+    def finish(self) -> str:
+        if self.digest is None:
+            if self.queue is not None:
+                t = time.perf_counter()
+                self.queue.put(None)
+                self.thread.join()
+                self.wait_seconds += time.perf_counter() - t
+            self.digest = self.h.hexdigest()
+        return self.digest
+
+def _fsync_dir(dir_abs: str):
+    fd = os.open(dir_abs, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# Leftover temp files and name reservations from a crash/kill mid-upload
+def _cleanup_temp_uploads():
+    for root, dirs, files in os.walk(DATA_DIR):
+        for name in files:
+            if name.startswith((TEMP_PREFIX, RESERVE_PREFIX)):
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:
+                    pass
+
+# Group commit: uploads that finish close together are fsync'd in one pass by a single
+# thread, and each folder is fsync'd once per batch instead of once per upload.
+class GroupCommitter:
+    def __init__(self, window: float):
+        self.window = window
+        self.pending = [] # [fd, tmp_path, target, no_clobber, done_event, error]
+        self.cond = threading.Condition()
+        self.thread = None
+
+    # Blocks until tmp_path is durable and moved to target
+    def commit(self, fd: int, tmp_path: str, target: str, no_clobber: bool=False):
+        item = [fd, tmp_path, target, no_clobber, threading.Event(), None]
+        with self.cond:
+            self._ensure_thread_unsafe()
+            self.pending.append(item)
+            self.cond.notify()
+        # If the committer died with our item still queued, a new one picks it up
+        while not item[4].wait(1.0):
+            with self.cond:
+                self._ensure_thread_unsafe()
+        if item[5] is not None:
+            raise item[5]
+
+    # Started lazily so each prefork worker gets its own, and again if it ever died
+    def _ensure_thread_unsafe(self):
+        if self.thread is None or not self.thread.is_alive():
+            if self.thread is not None:
+                log.error("Group commit thread died, restarting it")
+                analyzer.record_counter("durability", "committer_restarts")
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+            time.sleep(self.window)
+            with self.cond:
+                batch, self.pending = self.pending, []
+
+            # Whatever goes wrong, every waiter in the batch gets woken up with its error
+            dirs = set()
+            try:
+                for item in batch:
+                    fd, tmp_path, target, no_clobber = item[:4]
+                    try:
+                        os.fsync(fd)
+                        _move_into_place(tmp_path, target, no_clobber)
+                        dirs.add(os.path.dirname(target))
+                    except Exception as e:
+                        item[5] = e
+                for dir_abs in dirs:
+                    try:
+                        _fsync_dir(dir_abs)
+                    except OSError:
+                        pass
+            finally:
+                for item in batch:
+                    item[4].set()
+
+group_committer = GroupCommitter(GROUP_COMMIT_WINDOW)
+
+# Moves every stored file (and its digest) into the given layout. Run with the server stopped.
+def migrate_storage(layout: str):
+    other = "flat" if layout == "sharded" else "sharded"
+    moved = skipped = 0
+    for root, dirs, files in os.walk(DATA_DIR):
+        if SHARD_DIR in dirs:
+            dirs.remove(SHARD_DIR)
+        for name, src in list(_stored_files(root, other)):
+            dst = _shard_path(os.path.join(root, name), layout)
+            if os.path.exists(dst):
+                log.warning("Migrate: skipping %s, %s already exists", src, dst)
+                skipped += 1
+                continue
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.rename(src, dst)
+            try:
+                os.rename(_digest_path(src), _digest_path(dst))
+            except FileNotFoundError:
+                pass
+            moved += 1
+        if layout == "flat":
+            # Drop the emptied shard folders (anything still in them is left alone)
+            for shard_root, _, _ in os.walk(os.path.join(root, SHARD_DIR), topdown=False):
+                try:
+                    os.rmdir(shard_root)
+                except OSError:
+                    pass
+    log.info("Migrate: %d files moved to the %s layout, %d skipped", moved, layout, skipped,
+             extra={'event': 'migrate', 'moved': moved, 'skipped': skipped})
+
+# Files left in the other layout are invisible to clients, so say so at startup
+def _check_storage_layout():
+    if STORAGE_LAYOUT == "sharded":
+        stray = next(_stored_files(DATA_DIR, "flat"), None) is not None
+    else:
+        stray = os.path.isdir(os.path.join(DATA_DIR, SHARD_DIR))
+    if stray:
+        log.warning("%s has files outside the %s layout, run: python server.py --migrate %s",
+                    DATA_DIR, STORAGE_LAYOUT, STORAGE_LAYOUT)
+
+# Page cache hint for big transfers (advice is e.g. "POSIX_FADV_SEQUENTIAL"), no-op where unsupported
+def _fadvise(fd: int, advice: str, size: int):
+    if not FADVISE or size < FADVISE_MIN_BYTES or not hasattr(os, advice):
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, getattr(os, advice))
+    except OSError:
+        pass
+
+# Reserve the full extent up front so the filesystem can lay the file out contiguously
+def _preallocate(fd: int, size: int):
+    if not PREALLOCATE or size <= 0 or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError:
+        # Filesystem doesn't support it, plain writes still work
+        pass
+
+# Renames tmp_path over target. With no_clobber (a name we allocated) it links instead, which
+# fails rather than replace a file that showed up under that name in the meantime.
+def _move_into_place(tmp_path: str, target: str, no_clobber: bool=False):
+    if no_clobber:
+        os.link(tmp_path, target)
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, target)
+
+# Moves a finished upload into place according to DURABILITY.
+# Returns the seconds spent on fsync (0 for "none").
+def _commit_upload(f, tmp_path: str, target: str, no_clobber: bool=False) -> float:
+    f.flush()
+    start = time.time()
+    if DURABILITY == "group":
+        group_committer.commit(f.fileno(), tmp_path, target, no_clobber)
+    elif DURABILITY == "fsync":
+        os.fsync(f.fileno())
+        _move_into_place(tmp_path, target, no_clobber)
+        _fsync_dir(os.path.dirname(target))
+    else:
+        _move_into_place(tmp_path, target, no_clobber)
+        return 0.0
+    return time.time() - start
+
+# File-like object handed to tarfile, frames its output as <4-byte length><bytes>.
+# A zero-length frame marks the end of the stream.
+class _ChunkedSocketWriter:
+    def __init__(self, conn, transfer: Transfer, frame_size: int = ARCHIVE_FRAME_SIZE):
+        self.conn = conn
+        self.transfer = transfer
+        self.frame_size = frame_size
+        self.buf = bytearray()
+        self.bytes_sent = 0
+
+    def write(self, data) -> int:
+        self.buf += data
+        while len(self.buf) >= self.frame_size:
+            self._send_frame(self.buf[:self.frame_size])
+            del self.buf[:self.frame_size]
+        return len(data)
+
+    def _send_frame(self, payload):
+        self.transfer.throttle(len(payload))
+        self.conn.sendall(struct.pack("!I", len(payload)) + bytes(payload))
+        self.bytes_sent += len(payload)
+
+    def finish(self):
+        if self.buf:
+            self._send_frame(self.buf)
+            self.buf.clear()
+        self.conn.sendall(struct.pack("!I", 0))
+
+# Smoothed RTT in seconds from the kernel (Linux TCP_INFO), None where unavailable
+def _tcp_rtt(sock):
+    if not hasattr(socket, "TCP_INFO"):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        # 8 one-byte fields, then u32s: rto, ato, snd_mss, rcv_mss, ..., tcpi_rtt is the 16th (usec)
+        rtt_us = struct.unpack_from("8B16I", info)[8 + 15]
+    except (OSError, struct.error):
+        return None
+    return rtt_us / 1e6 if rtt_us else None
+
+def _set_buffers(sock, sndbuf, rcvbuf):
+    try:
+        if sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        if rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    except OSError:
+        pass
+
+# 2x bandwidth-delay product, clamped
+def _auto_buffer_size(rtt) -> int:
+    estimates = analyzer.network_estimates()
+    rate = estimates['throughput_bps'] or AUTO_DEFAULT_RATE
+    rtt = rtt or estimates['rtt_seconds'] or 0.0
+    return int(min(AUTO_BUFFER_MAX, max(AUTO_BUFFER_MIN, 2 * rate * rtt)))
+
+# Buffer sizes have to be on the listening socket before listen() to count for the
+# window scale negotiated at handshake, accepted sockets inherit them
+def _tune_listen_socket(sock):
+    profile = SOCKET_PROFILES.get(SOCKET_PROFILE, SOCKET_PROFILES["wan"])
+    if SOCKET_PROFILE != "auto":
+        _set_buffers(sock, profile["sndbuf"], profile["rcvbuf"])
+
+# Per connection settings, returns what was applied (recorded with the connect metric)
+def _tune_connection(conn) -> dict:
+    profile = SOCKET_PROFILES.get(SOCKET_PROFILE, SOCKET_PROFILES["wan"])
+    try:
+        if profile["nodelay"]:
+            # Commands/replies are small and each waits on the other side, don't let Nagle hold them
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if profile["keepalive"]:
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            idle, interval, count = profile["keepalive"]
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+    except OSError:
+        pass
+
+    rtt = _tcp_rtt(conn)
+    if SOCKET_PROFILE == "auto":
+        size = _auto_buffer_size(rtt)
+        _set_buffers(conn, size, size)
+    else:
+        # Usually inherited from the listening socket already, but the profile may have changed since
+        _set_buffers(conn, profile["sndbuf"], profile["rcvbuf"])
+
+    tuning = {'socket_profile': SOCKET_PROFILE}
+    if rtt is not None:
+        tuning['rtt_ms'] = round(rtt * 1000, 3)
+    try:
+        tuning['sndbuf'] = conn.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        tuning['rcvbuf'] = conn.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    except OSError:
+        pass
+    return tuning
 
 # sha256 func
 def sha256_hex(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
+# Token is "<username>.<expires_unix>.<hmac>"
+def issue_session_token(username: str) -> str:
+    payload = f"{username}.{int(time.time()) + SESSION_TTL}"
+    sig = hmac.new(SESSION_SECRET, payload.encode(FORMAT), hashlib.sha256).hexdigest()
+    return f"{payload}.{sig}"
+
+# Returns the username for a valid, unexpired token, else None
+def check_session_token(token: str):
+    try:
+        username, expires, sig = token.rsplit(".", 2)
+        expires = int(expires)
+    except ValueError:
+        return None
+    expected = hmac.new(SESSION_SECRET, f"{username}.{expires}".encode(FORMAT), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(sig, expected) or expires < time.time() or username not in USERS:
+        return None
+    return username
+
+
+# CHANGE NOTIFICATIONS ------------------------------------------>
+
+# Every push is one line: SNAPSHOT@<seq>@<DIR listing>, EVENT@<seq>@<added|removed>@<size>@<path>
+# or HEARTBEAT@<seq>. Folder paths end in "/", same as in DIR.
+class Subscriber:
+    def __init__(self, conn, client_id: str, last_seq: int, snapshot: bool):
+        self.conn = conn # non-blocking, only ever written by the sender thread
+        self.client_id = client_id
+        self.last_seq = last_seq
+        self.needs_snapshot = snapshot # needs a full listing before any more events
+        self.snapshot = None # (seq, listing) once the builder has one for us
+        self.out = bytearray() # queued for this subscriber, sent as the socket takes it
+        self.sent_at = time.monotonic()
+        self.progress_at = self.sent_at # last time the socket took any of out
+
+# Sequence-numbered ring of recent changes plus the subscribed sockets. Handlers only append
+# and wake the sender. One thread does all the sending, with non-blocking sockets and a buffer
+# per subscriber, so a slow reader only holds up itself. Full listings are built on a helper
+# thread and shared by everyone waiting for one.
+class ChangeFeed:
+    def __init__(self, history: int):
+        # Starts at the clock (usec) so a seq kept from before a restart is always too old, never "current"
+        self.seq = time.time_ns() // 1000
+        self.events = deque(maxlen=history) # (seq, line)
+        self.subscribers = []
+        self.snapshot_waiters = []
+        self.building = False # snapshot builder running
+        self.lock = threading.Lock()
+        self.thread = None
+        self.wake_r = self.wake_w = None # socketpair, a byte on it wakes the sender
+
+    def publish(self, kind: str, path: str, size: int=0):
+        with self.lock:
+            self.seq += 1
+            self.events.append((self.seq, f"EVENT@{self.seq}@{kind}@{size}@{path}\n"))
+            if self.subscribers:
+                self._wake()
+        analyzer.record_counter("notifications", "events_published")
+
+    # Takes over conn (the caller must not close it), False if we're full
+    def subscribe(self, conn, client_id: str, since) -> bool:
+        with self.lock:
+            if len(self.subscribers) >= MAX_SUBSCRIBERS:
+                return False
+            if self.thread is None:
+                # Started lazily so each prefork worker gets its own
+                self.wake_r, self.wake_w = socket.socketpair()
+                self.wake_r.setblocking(False)
+                self.wake_w.setblocking(False)
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            oldest = self.events[0][0] if self.events else self.seq + 1
+            caught_up = since is not None and oldest - 1 <= since <= self.seq
+            conn.setblocking(False)
+            self.subscribers.append(Subscriber(conn, client_id, since if caught_up else self.seq, not caught_up))
+            self._wake()
+            count = len(self.subscribers)
+        analyzer.record_gauge("notifications", "subscribers", count)
+        return True
+
+    def _wake(self):
+        try:
+            self.wake_w.send(b"\0")
+        except (BlockingIOError, AttributeError):
+            pass # already has a wakeup pending / nobody's listening yet
+
+    def _run(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self.wake_r, selectors.EVENT_READ)
+        writing = set() # subscribers registered for EVENT_WRITE
+        while True:
+            for key, _ in sel.select(timeout=1.0):
+                if key.fileobj is self.wake_r:
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+
+            now = time.monotonic()
+            with self.lock:
+                seq = self.seq
+                oldest = self.events[0][0] if self.events else seq + 1
+                subscribers = list(self.subscribers)
+                need_from = min((s.last_seq for s in subscribers), default=seq)
+                events = [e for e in self.events if e[0] > need_from]
+
+            dropped = []
+            for sub in subscribers:
+                try:
+                    self._fill(sub, seq, oldest, events, now)
+                    self._flush(sub, now)
+                except OSError:
+                    dropped.append(sub)
+                    continue
+                if sub.out and now - sub.progress_at >= SUBSCRIBER_SEND_TIMEOUT:
+                    # Not reading, give up on it rather than buffer forever
+                    dropped.append(sub)
+
+            want = {sub for sub in subscribers if sub.out} - set(dropped)
+            for sub in writing - want:
+                sel.unregister(sub.conn)
+            for sub in want - writing:
+                sel.register(sub.conn, selectors.EVENT_WRITE, sub)
+            writing = want
+
+            if dropped:
+                with self.lock:
+                    for sub in dropped:
+                        self.subscribers.remove(sub)
+                        if sub in self.snapshot_waiters:
+                            self.snapshot_waiters.remove(sub)
+                    count = len(self.subscribers)
+                for sub in dropped:
+                    sub.conn.close()
+                    analyzer.record_connection(sub.client_id, "unsubscribe")
+                analyzer.record_counter("notifications", "dropped_subscribers", len(dropped))
+                analyzer.record_gauge("notifications", "subscribers", count)
+
+    # Queues whatever sub is due: its snapshot once built, missed events, or a heartbeat
+    def _fill(self, sub: Subscriber, seq: int, oldest: int, events: list, now: float):
+        if sub.snapshot is not None:
+            snap_seq, listing = sub.snapshot
+            if listing is None:
+                raise OSError("snapshot failed")
+            sub.out += f"SNAPSHOT@{snap_seq}@{listing}\n".encode(FORMAT)
+            sub.snapshot, sub.needs_snapshot, sub.last_seq, sub.sent_at = None, False, snap_seq, now
+            analyzer.record_counter("notifications", "snapshots")
+
+        if not sub.needs_snapshot and sub.last_seq < oldest - 1:
+            # Fell further behind than the history goes
+            sub.needs_snapshot = True
+        if sub.needs_snapshot:
+            self._request_snapshot(sub)
+            return
+
+        if sub.last_seq < seq:
+            pending = [line for event_seq, line in events if event_seq > sub.last_seq]
+            sub.out += "".join(pending).encode(FORMAT)
+            sub.last_seq, sub.sent_at = seq, now
+            analyzer.record_counter("notifications", "events_sent", len(pending))
+        elif not sub.out and now - sub.sent_at >= HEARTBEAT_INTERVAL:
+            sub.out += f"HEARTBEAT@{seq}\n".encode(FORMAT)
+            sub.sent_at = now
+
+    def _flush(self, sub: Subscriber, now: float):
+        if not sub.out:
+            sub.progress_at = now
+            return
+        try:
+            sent = sub.conn.send(sub.out)
+        except BlockingIOError:
+            return
+        if sent:
+            del sub.out[:sent]
+            sub.progress_at = now
+
+    def _request_snapshot(self, sub: Subscriber):
+        with self.lock:
+            if sub in self.snapshot_waiters or sub.snapshot is not None:
+                return
+            self.snapshot_waiters.append(sub)
+            if self.building:
+                return
+            self.building = True
+        threading.Thread(target=self._build_snapshot, daemon=True).start()
+
+    # Walks the tree off the sender thread. The seq is read first, so anything published during
+    # the walk is sent again as events afterwards, re-applying those is harmless. One listing
+    # serves every waiter, including ones that started waiting mid-walk.
+    def _build_snapshot(self):
+        with self.lock:
+            seq = self.seq
+        try:
+            listing = _dir_listing()
+        except Exception as e:
+            log.error("Snapshot for subscribers failed: %s", e)
+            listing = None
+        with self.lock:
+            waiters, self.snapshot_waiters = self.snapshot_waiters, []
+            self.building = False
+            for sub in waiters:
+                sub.snapshot = (seq, listing)
+            self._wake()
+
+change_feed = ChangeFeed(CHANGE_HISTORY)
+_prefork_worker = False # each worker has its own feed, so SUBSCRIBE would miss the others' changes
+
+# Client path -> path as DIR shows it (normalized, relative to DATA_DIR)
+def _logical_rel(abs_path: str) -> str:
+    return os.path.relpath(abs_path, os.path.abspath(DATA_DIR))
+
+# os.makedirs that publishes every folder it had to create
+def _make_folders(dir_abs: str):
+    missing = []
+    path = dir_abs
+    while not os.path.isdir(path):
+        missing.append(path)
+        path = os.path.dirname(path)
+    os.makedirs(dir_abs, exist_ok=True)
+    for created in reversed(missing):
+        change_feed.publish("added", _logical_rel(created) + "/")
+
 
 # COMMAND HANDLERS ------------------------------------------>
 
@@ -123,36 +1283,48 @@ def handle_connect(conn, addr, parts, client_id):
         conn.sendall("ERROR@Usage: CONNECT <username> <sha256_hex_password>".encode(FORMAT))
         return False
 
+    auth_start = time.time()
     username, pw_hex = parts[1], parts[2]
     expected = USERS.get(username)
 
-    auth_start = time.time()
     # I hate that this if statement works
     if expected and expected == pw_hex:
+        token = issue_session_token(username)
         dur = time.time() - auth_start
-        analyzer.record_connection(client_id, "auth_success", dur)
-        conn.sendall("OK@Authenticated".encode(FORMAT))
+        analyzer.record_connection(client_id, "auth_success", dur, extra={'auth_method': 'password'})
+        conn.sendall(f"OK@Authenticated@{token}@{SESSION_TTL}".encode(FORMAT))
         return True
     else:
         dur = time.time() - auth_start
-        analyzer.record_connection(client_id, "auth_fail", dur)
+        analyzer.record_connection(client_id, "auth_fail", dur, extra={'auth_method': 'password'})
         conn.sendall("DISCONNECTED@Authentication failed".encode(FORMAT))
         return False
 
+# EXPECTED USAGE: RESUME <session_token>
+# Authenticates an extra/reconnecting socket with the token from CONNECT (or an earlier RESUME),
+# replies with a renewed token. Returns the username or None
+def handle_resume(conn, parts, client_id):
+    if len(parts) != 2:
+        conn.sendall("ERROR@Usage: RESUME <session_token>".encode(FORMAT))
+        return None
+
+    auth_start = time.time()
+    username = check_session_token(parts[1])
+    dur = time.time() - auth_start
+
+    if username is None:
+        analyzer.record_connection(client_id, "auth_fail", dur, extra={'auth_method': 'token'})
+        conn.sendall("DISCONNECTED@Invalid or expired session".encode(FORMAT))
+        return None
+
+    analyzer.record_connection(client_id, "auth_success", dur, extra={'auth_method': 'token'})
+    conn.sendall(f"OK@Resumed@{issue_session_token(username)}@{SESSION_TTL}".encode(FORMAT))
+    return username
+
 # EXPECTED USAGE: DIR
 # Shows dir
 def handle_dir(conn, client_id):
-    entries = []
-    for root, dirs, files in os.walk(DATA_DIR):
-        rel_root = os.path.relpath(root, DATA_DIR)
-        if rel_root == ".":
-            rel_root = ""
-        for d in dirs:
-            entries.append(os.path.join(rel_root, d) + "/")
-        for f in files:
-            entries.append(os.path.join(rel_root, f))
-    listing = ",".join(entries) if entries else "<empty>"
-    conn.sendall(f"OK@{listing}".encode(FORMAT))
+    conn.sendall(f"OK@{_dir_listing()}".encode(FORMAT))
 
     analyzer.record_action(
         action_type="dir",
@@ -163,6 +1335,18 @@ def handle_dir(conn, client_id):
         status="success",
     )
 
+def _dir_listing() -> str:
+    entries = []
+    for root, dirs, files in _walk_logical(DATA_DIR):
+        rel_root = os.path.relpath(root, DATA_DIR)
+        if rel_root == ".":
+            rel_root = ""
+        for d in dirs:
+            entries.append(os.path.join(rel_root, d) + "/")
+        for f, _ in files:
+            entries.append(os.path.join(rel_root, f))
+    return ",".join(entries) if entries else "<empty>"
+
 # EXPECTED USAGE: SUBFOLDER create <relative_path>
 #                 SUBFOLDER delete <relative_path>
 # Handles subdir creation/deletion
@@ -182,7 +1366,7 @@ def handle_subfolder(conn, parts, client_id):
 
     if subcmd == "create":
         try:
-            os.makedirs(target, exist_ok=True)
+            _make_folders(target)
             conn.sendall("OK@Folder created".encode(FORMAT))
             analyzer.record_action("subfolder_create", rel_path, 0, 0.0, client_id, "success")
         except Exception as e:
@@ -191,7 +1375,19 @@ def handle_subfolder(conn, parts, client_id):
 
     elif subcmd == "delete":
         try:
+            # Only our hidden bookkeeping (digests, emptied shard folders) may be left behind, clear that first
+            leftovers = os.listdir(target)
+            if (all(name == SHARD_DIR or (_is_hidden(name) and os.path.isfile(os.path.join(target, name)))
+                    for name in leftovers)
+                    and next(_stored_files(target, "sharded"), None) is None):
+                for name in leftovers:
+                    if name == SHARD_DIR:
+                        shutil.rmtree(os.path.join(target, name))
+                    else:
+                        os.remove(os.path.join(target, name))
             os.rmdir(target)  # will fail if not empty
+            file_handles.invalidate_tree(target)
+            change_feed.publish("removed", _logical_rel(target) + "/")
             conn.sendall("OK@Folder deleted".encode(FORMAT))
             analyzer.record_action("subfolder_delete", rel_path, 0, 0.0, client_id, "success")
         except Exception as e:
@@ -209,12 +1405,13 @@ def handle_delete(conn, parts, client_id):
     rel_path = " ".join(parts[1:])
 
     try:
-        target = safe_path(rel_path)
+        target = file_handles.resolve(rel_path)
     except ValueError:
         conn.sendall("ERROR@Invalid path".encode(FORMAT))
         return
 
-    if not os.path.isfile(target):
+    st = file_handles.stat(target)
+    if st is None or not stat.S_ISREG(st.st_mode):
         conn.sendall("ERROR@File does not exist".encode(FORMAT))
         return
 
@@ -224,17 +1421,26 @@ def handle_delete(conn, parts, client_id):
 
     try:
         os.remove(target)
-        conn.sendall("OK@File deleted".encode(FORMAT))
-        analyzer.record_action("delete", rel_path, 0, 0.0, client_id, "success")
+        try:
+            os.remove(_digest_path(target))
+        except FileNotFoundError:
+            pass
+        content_cache.invalidate(target)
+        file_handles.invalidate(target)
+        change_feed.publish("removed", _logical_rel(safe_path(rel_path)))
+        status, reply = "success", "OK@File deleted"
     except Exception as e:
-        conn.sendall(f"ERROR@{e}".encode(FORMAT))
-        analyzer.record_action("delete", rel_path, 0, 0.0, client_id, "failure")
+        status, reply = "failure", f"ERROR@{e}"
     finally:
+        # Unlock before replying, the client may reuse the name right away
         release_file_lock(target)
 
+    conn.sendall(reply.encode(FORMAT))
+    analyzer.record_action("delete", rel_path, 0, 0.0, client_id, status)
+
 # EXPECTED USAGE: UPLOAD <remote_path> <filesize_bytes>
 # Handles uploads to server
-def handle_upload(conn, parts, client_id):
+def handle_upload(conn, parts, client_id, username):
     if len(parts) < 3:
         conn.sendall("ERROR@Usage: UPLOAD <path> <filesize_bytes>".encode(FORMAT))
         return
@@ -257,23 +1463,28 @@ def handle_upload(conn, parts, client_id):
         conn.sendall("ERROR@Invalid path".encode(FORMAT))
         return
 
+    _make_folders(dir_abs)
+
+    # reserved = we hold a freshly allocated name through its hidden placeholder
+    reserved = False
     if _looks_like_server_name(requested_name):
         stored_name = requested_name
     else:
         prefix = _prefix_for_ext(ext)
         stored_name = _allocate_server_filename(dir_abs, prefix, ext)
+        reserved = True
 
     stored_rel = os.path.join(rel_dir, stored_name) if rel_dir else stored_name
 
     try:
-        target = safe_path(stored_rel)
+        target = resolve_file(stored_rel)
     except ValueError:
         conn.sendall("ERROR@Invalid path".encode(FORMAT))
         return
+    if STORAGE_LAYOUT == "sharded":
+        os.makedirs(os.path.dirname(target), exist_ok=True)
 
-    os.makedirs(os.path.dirname(target), exist_ok=True)
-
-    if os.path.exists(target):
+    if not reserved and os.path.exists(target):
         conn.sendall("OK@EXISTS".encode(FORMAT))
         ans = conn.recv(SIZE).decode(FORMAT).strip().lower()
         if ans != "y":
@@ -282,39 +1493,109 @@ def handle_upload(conn, parts, client_id):
             return
 
     if not acquire_file_lock(target):
+        if reserved:
+            os.remove(_reservation_path(target))
         conn.sendall("ERROR@File is currently being processed".encode(FORMAT))
         analyzer.record_action("upload", stored_rel, filesize, 0.0, client_id, "failure")
         return
 
+    # Bytes go to a hidden temp file in the same folder, DIR/DOWNLOAD only ever see
+    # the old file or the complete new one
+    try:
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=TEMP_PREFIX)
+        os.fchmod(tmp_fd, 0o644)
+    except OSError as e:
+        if reserved:
+            os.remove(_reservation_path(target))
+        release_file_lock(target)
+        conn.sendall(f"ERROR@{e}".encode(FORMAT))
+        analyzer.record_action("upload", stored_rel, filesize, 0.0, client_id, "failure")
+        return
+
     conn.sendall(f"READY@{filesize}".encode(FORMAT))
 
     start = time.time()
     remaining = filesize
     status = "success"
+    fsync_seconds = 0.0
+    committed = False
+    checksum_ok = True
+    transfer = scheduler.start(username, filesize)
+    hasher = StreamHasher(filesize)
+
+    # Network reads land in one big buffer that's written out when full
+    buf = bytearray(max(1, min(WRITE_BUFFER_SIZE, filesize)))
+    view = memoryview(buf)
+    filled = 0
 
     try:
-        with open(target, "wb") as f:
+        with os.fdopen(tmp_fd, "wb") as f:
+            _preallocate(f.fileno(), filesize)
+            _fadvise(f.fileno(), "POSIX_FADV_SEQUENTIAL", filesize)
+
             while remaining > 0:
-                chunk = conn.recv(min(SIZE, remaining))
-                if not chunk:
+                n = conn.recv_into(view[filled:], min(len(buf) - filled, remaining))
+                if not n:
                     status = "failure"
                     break
-                f.write(chunk)
-                remaining -= len(chunk)
+                filled += n
+                remaining -= n
+                transfer.throttle(n)
+                if filled == len(buf) or remaining == 0:
+                    hasher.update(view[:filled])
+                    f.write(view[:filled])
+                    filled = 0
+
+            if status == "success":
+                # Client follows the data with SHA256@<hex> of what it sent
+                client_digest = conn.recv(SIZE).decode(FORMAT).strip()
+                if client_digest != f"SHA256@{hasher.finish()}":
+                    status = "failure"
+                    checksum_ok = False
+
+            if status == "success":
+                fsync_seconds = _commit_upload(f, tmp_path, target, no_clobber=reserved)
+                committed = True
+                # Written (and synced, unless DURABILITY is "none"), don't let it crowd out hot files
+                _fadvise(f.fileno(), "POSIX_FADV_DONTNEED", filesize)
     except Exception:
         status = "failure"
+    finally:
+        transfer.finish()
+        hasher.finish()
 
     duration = time.time() - start
+    if committed:
+        _store_digest(target, hasher.digest)
+        change_feed.publish("added", _logical_rel(safe_path(stored_rel)), filesize)
+    stale = [_reservation_path(target)] if reserved else []
+    if not committed:
+        # Don't leave a half-written file behind
+        stale.append(tmp_path)
+    for path in stale:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    content_cache.invalidate(target)
+    file_handles.invalidate(target)
     release_file_lock(target)
 
-    analyzer.record_action("upload", stored_rel, filesize, duration, client_id, status)
+    analyzer.record_action("upload", stored_rel, filesize, duration, client_id, status,
+                           extra={'throttle_seconds': round(transfer.throttle_seconds, 4),
+                                  'fsync_seconds': round(fsync_seconds, 4),
+                                  'hash_seconds': round(hasher.hash_seconds, 4),
+                                  'hash_wait_seconds': round(hasher.wait_seconds, 4),
+                                  'checksum_ok': checksum_ok})
 
     if status == "success" and remaining == 0:
         conn.sendall(f"OK@Upload complete: {stored_rel}".encode(FORMAT))
+    elif not checksum_ok:
+        conn.sendall("ERROR@Checksum mismatch, upload discarded".encode(FORMAT))
     else:
         conn.sendall("ERROR@Upload incomplete".encode(FORMAT))
 
-def handle_download(conn, parts, client_id):
+def handle_download(conn, parts, client_id, username):
     if len(parts) < 2:
         conn.sendall("ERROR@Usage: DOWNLOAD <path>".encode(FORMAT))
         return
@@ -322,12 +1603,13 @@ def handle_download(conn, parts, client_id):
     rel_path = " ".join(parts[1:])
 
     try:
-        target = safe_path(rel_path)
+        target = file_handles.resolve(rel_path)
     except ValueError:
         conn.sendall("ERROR@Invalid path".encode(FORMAT))
         return
 
-    if not os.path.isfile(target):
+    st = file_handles.stat(target)
+    if st is None or not stat.S_ISREG(st.st_mode):
         conn.sendall("ERROR@File not found".encode(FORMAT))
         return
 
@@ -335,41 +1617,237 @@ def handle_download(conn, parts, client_id):
         conn.sendall("ERROR@File is currently being processed".encode(FORMAT))
         return
 
-    filesize = os.path.getsize(target)
+    # Files too big to ever be cached skip the lookup (and don't count as misses)
+    cached = content_cache.get(target, st) if content_cache.wants(st.st_size) else None
+    handle = None
+    if cached is None:
+        # Pooled fd for hot files, its stat is what we'll actually send
+        handle = file_handles.open(target)
+        if handle is None:
+            release_file_lock(target)
+            conn.sendall("ERROR@File not found".encode(FORMAT))
+            return
+        st = handle.st
+
+    filesize = len(cached[0]) if cached is not None else st.st_size
     conn.sendall(f"FILEINFO@{filesize}".encode(FORMAT))
     ack = conn.recv(SIZE).decode(FORMAT).strip()
 
     if ack.upper() != "READY":
+        if handle is not None:
+            file_handles.release(handle)
         release_file_lock(target)
         return
 
     start = time.time()
     status = "success"
+    transfer = scheduler.start(username, filesize)
+    # Digest saved at upload time means no rehash, otherwise hash while sending
+    digest = cached[1] if cached is not None else _load_digest(target, st)
+    stored_digest = digest is not None
+    hasher = None if stored_digest else StreamHasher(filesize)
 
     try:
-        with open(target, "rb") as f:
-            while True:
-                chunk = f.read(SIZE)
+        if cached is not None:
+            transfer.throttle(filesize)
+            conn.sendall(cached[0])
+            analyzer.record_counter("content_cache", "bytes_served", filesize)
+        elif content_cache.wants(filesize):
+            # Small enough to keep, read it in one go and remember it
+            data = os.pread(handle.fd, filesize, 0)
+            if len(data) != filesize:
+                raise OSError("File shrank while sending")
+            transfer.throttle(len(data))
+            conn.sendall(data)
+            if hasher is not None:
+                hasher.update(data)
+                digest = hasher.finish()
+            content_cache.put(target, st, data, digest)
+        else:
+            # The fd may be shared with other readers, so pread at our own offset
+            _fadvise(handle.fd, "POSIX_FADV_SEQUENTIAL", filesize)
+            offset = 0
+            while offset < filesize:
+                chunk = os.pread(handle.fd, min(SIZE, filesize - offset), offset)
                 if not chunk:
-                    break
+                    raise OSError("File shrank while sending")
+                offset += len(chunk)
+                transfer.throttle(len(chunk))
                 conn.sendall(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+            _fadvise(handle.fd, "POSIX_FADV_DONTNEED", filesize)
+
+        if hasher is not None:
+            digest = hasher.finish()
+            _store_digest(target, digest)
     except Exception:
         status = "failure"
+    finally:
+        transfer.finish()
+        if hasher is not None:
+            hasher.finish()
+        if handle is not None:
+            file_handles.release(handle)
 
     duration = time.time() - start
+    # Unlock before the trailer, the client may act on the file as soon as it has it
     release_file_lock(target)
 
-    analyzer.record_action("download", rel_path, filesize, duration, client_id, status)
+    if status == "success":
+        conn.sendall(f"SHA256@{digest}".encode(FORMAT))
+
+    analyzer.record_action("download", rel_path, filesize, duration, client_id, status,
+                           extra={'throttle_seconds': round(transfer.throttle_seconds, 4),
+                                  'hash_seconds': round(hasher.hash_seconds, 4) if hasher else 0.0,
+                                  'hash_wait_seconds': round(hasher.wait_seconds, 4) if hasher else 0.0,
+                                  'stored_digest': stored_digest})
+
+
+# EXPECTED USAGE: ARCHIVE <tar|tgz> <relative_path>
+# Streams a whole subfolder as one tar stream, built on the fly (no temp archive on disk)
+def handle_archive(conn, parts, client_id, username):
+    if len(parts) < 3:
+        conn.sendall("ERROR@Usage: ARCHIVE <tar|tgz> <path>".encode(FORMAT))
+        return
+
+    fmt = parts[1].lower()
+    if fmt not in ARCHIVE_MODES:
+        conn.sendall("ERROR@Unknown ARCHIVE format".encode(FORMAT))
+        return
+
+    rel_path = " ".join(parts[2:])
+
+    try:
+        target = safe_path(rel_path)
+    except ValueError:
+        conn.sendall("ERROR@Invalid path".encode(FORMAT))
+        return
+
+    if not os.path.isdir(target):
+        conn.sendall("ERROR@Folder not found".encode(FORMAT))
+        return
+
+    conn.sendall(f"ARCHIVE@{fmt}".encode(FORMAT))
+    ack = conn.recv(SIZE).decode(FORMAT).strip()
+
+    if ack.upper() != "READY":
+        return
+
+    # Everything in the archive lives under the folder's own name
+    top = os.path.basename(target)
+    # Size isn't known up front, so archives are always scheduled as big transfers
+    transfer = scheduler.start(username)
+    writer = _ChunkedSocketWriter(conn, transfer)
+    added = 0
+    skipped = 0
+    status = "success"
+    start = time.time()
+
+    try:
+        with tarfile.open(fileobj=writer, mode=ARCHIVE_MODES[fmt]) as tar:
+            for root, dirs, files in _walk_logical(target):
+                dirs.sort()
+                rel_root = os.path.relpath(root, target)
+                arc_root = top if rel_root == "." else os.path.join(top, rel_root)
+                tar.add(root, arcname=arc_root, recursive=False)
+
+                for name, file_abs in sorted(files):
+                    # Same rule as DOWNLOAD, skip anything that's mid-upload/delete
+                    if not acquire_file_lock(file_abs):
+                        skipped += 1
+                        continue
+                    try:
+                        tar.add(file_abs, arcname=os.path.join(arc_root, name), recursive=False)
+                        added += 1
+                    except FileNotFoundError:
+                        skipped += 1
+                    finally:
+                        release_file_lock(file_abs)
+    except Exception:
+        status = "failure"
+
+    duration = time.time() - start
+
+    try:
+        writer.finish()
+        if status == "success":
+            conn.sendall(f"OK@Archive complete: {added} files, {skipped} skipped".encode(FORMAT))
+        else:
+            conn.sendall("ERROR@Archive incomplete".encode(FORMAT))
+    finally:
+        transfer.finish()
+        analyzer.record_action("archive", rel_path, writer.bytes_sent, duration, client_id, status,
+                               extra={'throttle_seconds': round(transfer.throttle_seconds, 4)})
+
+
+# EXPECTED USAGE: SUBSCRIBE [<last_seq>]
+# Turns this connection into a push-only change feed (see ChangeFeed). Meant for an extra
+# RESUME'd socket. Returns True once the feed owns the socket.
+def handle_subscribe(conn, parts, client_id) -> bool:
+    try:
+        since = int(parts[1]) if len(parts) > 1 else None
+    except ValueError:
+        conn.sendall("ERROR@Usage: SUBSCRIBE [<last_seq>]".encode(FORMAT))
+        return False
+
+    if _prefork_worker:
+        conn.sendall("ERROR@Notifications not available with multiple worker processes".encode(FORMAT))
+        return False
+
+    if not change_feed.subscribe(conn, client_id, since):
+        conn.sendall("ERROR@Too many subscribers".encode(FORMAT))
+        return False
+
+    analyzer.record_connection(client_id, "subscribe")
+    return True
+
+# EXPECTED USAGE: RATELIMIT
+#                 RATELIMIT <global|client> <bytes_per_sec>   (0 = unlimited, admins only)
+# Shows or changes the bandwidth limits while the server is running
+def handle_ratelimit(conn, parts, client_id, username):
+    if len(parts) == 1:
+        conn.sendall(f"OK@global={scheduler.global_rate} client={scheduler.client_rate}".encode(FORMAT))
+        return
+
+    if username not in ADMIN_USERS:
+        conn.sendall("ERROR@Not allowed".encode(FORMAT))
+        return
+
+    if len(parts) != 3 or parts[1].lower() not in ("global", "client"):
+        conn.sendall("ERROR@Usage: RATELIMIT <global|client> <bytes_per_sec>".encode(FORMAT))
+        return
+
+    # Each worker has its own scheduler, a change here would only reach whichever one accepted us
+    if _prefork_worker:
+        conn.sendall("ERROR@Limits can't be changed live with multiple worker processes, set them in CONFIG".encode(FORMAT))
+        return
+
+    try:
+        rate = int(parts[2])
+    except ValueError:
+        conn.sendall("ERROR@bytes_per_sec must be int".encode(FORMAT))
+        return
+
+    if parts[1].lower() == "global":
+        scheduler.set_limits(global_rate=max(0, rate))
+    else:
+        scheduler.set_limits(client_rate=max(0, rate))
+    conn.sendall(f"OK@global={scheduler.global_rate} client={scheduler.client_rate}".encode(FORMAT))
+    analyzer.record_action("ratelimit", parts[1].lower(), 0, 0.0, client_id, "success")
 
 
 # CLIENT THREAD ------------------------------------------>
 
 def handle_client(conn, addr):
     client_id = f"{addr[0]}:{addr[1]}"
-    print(f"[NEW CONNECTION] {client_id}")
-    analyzer.record_connection(client_id, "connect")
+    log.info("New connection %s", client_id, extra={'event': 'connect', 'client_id': client_id, 'sampled': True})
+    analyzer.record_connection(client_id, "connect", extra=_tune_connection(conn))
+    conn.settimeout(IDLE_TIMEOUT)
 
     authenticated = False
+    username = None
+    handed_off = False # socket now belongs to the change feed
 
     try:
         while True:
@@ -389,6 +1867,12 @@ def handle_client(conn, addr):
                     if not authenticated:
                         # handle_connect already sent DISCONNECTED
                         break
+                    username = parts[1]
+                elif cmd == "RESUME":
+                    username = handle_resume(conn, parts, client_id)
+                    authenticated = username is not None
+                    if not authenticated:
+                        break
                 else:
                     conn.sendall("ERROR@You must CONNECT first".encode(FORMAT))
                 continue
@@ -401,9 +1885,17 @@ def handle_client(conn, addr):
             elif cmd == "DELETE":
                 handle_delete(conn, parts, client_id)
             elif cmd == "UPLOAD":
-                handle_upload(conn, parts, client_id)
+                handle_upload(conn, parts, client_id, username)
             elif cmd == "DOWNLOAD":
-                handle_download(conn, parts, client_id)
+                handle_download(conn, parts, client_id, username)
+            elif cmd == "ARCHIVE":
+                handle_archive(conn, parts, client_id, username)
+            elif cmd == "RATELIMIT":
+                handle_ratelimit(conn, parts, client_id, username)
+            elif cmd == "SUBSCRIBE":
+                if handle_subscribe(conn, parts, client_id):
+                    handed_off = True
+                    break
             elif cmd in ("LOGOUT", "QUIT", "EXIT"):
                 analyzer.record_connection(client_id, "disconnect")
                 conn.sendall("DISCONNECTED@Goodbye".encode(FORMAT))
@@ -411,35 +1903,177 @@ def handle_client(conn, addr):
             else:
                 conn.sendall("ERROR@Unknown command".encode(FORMAT))
 
+    except socket.timeout:
+        # Stalled/idle socket, free the worker for someone else
+        analyzer.record_connection(client_id, "idle_timeout")
+        analyzer.record_counter("admission", "idle_timeouts")
     except Exception as e:
-        print(f"[ERROR] Client {client_id}: {e}")
+        log.error("Client %s: %s", client_id, e, extra={'event': 'client_error', 'client_id': client_id})
     finally:
-        conn.close()
-        print(f"[DISCONNECTED] {client_id}")
+        if not handed_off:
+            conn.close()
+
+    if handed_off:
+        log.info("Subscribed %s", client_id, extra={'event': 'subscribe', 'client_id': client_id, 'sampled': True})
+    else:
+        log.info("Disconnected %s", client_id, extra={'event': 'disconnect', 'client_id': client_id, 'sampled': True})
 
 
 # SERVER LOOP ------------------------------------------>
 
-def start_server():
-    ensure_data_dir()
+# Accepted connections wait here for one of the MAX_WORKERS handler threads
+pending_conns = queue.Queue(maxsize=MAX_QUEUED)
+
+# Open (queued or active) connections per client IP
+ip_conn_counts = {}
+ip_conn_counts_lock = threading.Lock()
+
+def _claim_ip(ip: str) -> bool:
+    with ip_conn_counts_lock:
+        if ip_conn_counts.get(ip, 0) >= MAX_CONN_PER_IP:
+            return False
+        ip_conn_counts[ip] = ip_conn_counts.get(ip, 0) + 1
+        return True
+
+def _release_ip(ip: str):
+    with ip_conn_counts_lock:
+        if ip in ip_conn_counts:
+            ip_conn_counts[ip] -= 1
+            if ip_conn_counts[ip] <= 0:
+                del ip_conn_counts[ip]
+
+# Turn a connection away right after accept, telling the client when to come back
+def _reject(conn, addr, reason: str):
+    try:
+        conn.settimeout(1)
+        conn.sendall(f"BUSY@{RETRY_AFTER}@{reason}".encode(FORMAT))
+    except OSError:
+        pass
+    finally:
+        conn.close()
+    analyzer.record_connection(f"{addr[0]}:{addr[1]}", "rejected")
+    analyzer.record_counter("admission", "rejected")
+
+def _worker_loop():
+    while True:
+        conn, addr, queued_at = pending_conns.get()
+        try:
+            analyzer.record_connection(f"{addr[0]}:{addr[1]}", "queue_wait", time.time() - queued_at)
+            handle_client(conn, addr)
+        finally:
+            _release_ip(addr[0])
+
+def _open_listen_socket(reuse_port: bool=False):
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Every worker process binds the same port, the kernel spreads connections between them
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    _tune_listen_socket(server)
     server.bind(ADDR)
-    server.listen(5)
+    server.listen(LISTEN_BACKLOG)
+    return server
 
-    print(f"[LISTENING] Server on {HOST}:{PORT}")
+def _serve(server):
+    # Fixed pool instead of a thread per connection
+    for _ in range(MAX_WORKERS):
+        threading.Thread(target=_worker_loop, daemon=True).start()
 
     try:
         while True:
             conn, addr = server.accept()
-            # Multithreading is easy, actually
-            t = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
-            t.start()
+
+            if not _claim_ip(addr[0]):
+                _reject(conn, addr, "Too many connections from your address")
+                continue
+
+            try:
+                pending_conns.put_nowait((conn, addr, time.time()))
+            except queue.Full:
+                _release_ip(addr[0])
+                _reject(conn, addr, "Server busy")
+                continue
+
+            analyzer.record_counter("admission", "admitted")
+            analyzer.record_gauge("admission", "queue_depth", pending_conns.qsize())
     except KeyboardInterrupt:
-        print("\n[SHUTDOWN] Stopping server...")
+        log.info("Stopping server...")
     finally:
         analyzer.stop()
         server.close()
 
+# Forks N workers that each accept on the same port. Each worker records into its own
+# analyzer, the parent merges them into one server report once they've all exited.
+def _start_prefork(workers: int):
+    global analyzer, _prefork_worker
+    worker_analyzers = [NetworkAnalysisModule(source=f"server_worker{i}", verbose=True, db_path=METRICS_DB)
+                        for i in range(workers)]
+    parent_analyzer = analyzer
+
+    children = []
+    for worker_analyzer in worker_analyzers:
+        pid = os.fork()
+        if pid == 0:
+            analyzer = worker_analyzer
+            _prefork_worker = True
+            try:
+                _serve(_open_listen_socket(reuse_port=True))
+            except Exception as e:
+                log.error("Worker %d: %s", os.getpid(), e)
+            finally:
+                # os._exit skips atexit, flush the log queue ourselves
+                logutil.shutdown()
+                os._exit(0)
+        children.append(pid)
+
+    log.info("Listening on %s:%d (%d worker processes)", HOST, PORT, workers)
+
+    # Ctrl+C reaches the whole process group, so just wait for the workers to save and exit
+    remaining = list(children)
+    while remaining:
+        try:
+            os.waitpid(remaining[0], 0)
+        except ChildProcessError:
+            pass
+        except KeyboardInterrupt:
+            log.info("Waiting for workers to stop...")
+            continue
+        remaining.pop(0)
+
+    parent_analyzer.merge_reports([a.json_file for a in worker_analyzers],
+                                  [a.counters_file for a in worker_analyzers])
+    parent_analyzer.stop()
+
+def start_server(workers: int=WORKER_PROCESSES):
+    ensure_data_dir()
+    _cleanup_temp_uploads()
+    _check_storage_layout()
+
+    if workers > 1:
+        _start_prefork(workers)
+        return
+
+    server = _open_listen_socket()
+    log.info("Listening on %s:%d", HOST, PORT)
+    _serve(server)
+
 
 if __name__ == "__main__":
-    start_server()
+    parser = argparse.ArgumentParser(description="Socket file server")
+    parser.add_argument("--workers", type=int, default=WORKER_PROCESSES,
+                        help="worker processes sharing the port (prefork mode when > 1)")
+    parser.add_argument("--migrate", choices=["flat", "sharded"],
+                        help="move DATA_DIR into this storage layout and exit (server must be stopped)")
+    parser.add_argument("--socket-profile", choices=sorted(SOCKET_PROFILES) + ["auto"], default=None,
+                        help=f"socket tuning profile (default: {SOCKET_PROFILE})")
+    parser.add_argument("--log-level", default=None, help="DEBUG, INFO, WARNING, ... (default: logutil.LOG_LEVEL)")
+    parser.add_argument("--log-format", choices=["text", "json"], default=None)
+    parser.add_argument("--log-file", default=None, help="write logs here instead of stdout")
+    args = parser.parse_args()
+    logutil.setup_logging(args.log_level, args.log_format, args.log_file)
+    SOCKET_PROFILE = args.socket_profile or SOCKET_PROFILE
+    if args.migrate:
+        ensure_data_dir()
+        migrate_storage(args.migrate)
+    else:
+        start_server(args.workers)